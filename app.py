@@ -1,12 +1,16 @@
-import asyncio
+import logging
+import os
+import time
 import streamlit as st
 from pipeline.pipeline import Pipeline
+from src.conversation_memory import ConversationMemory
+from src.response_parser import StreamingAnswer
 
-# Ensure an asyncio event loop is running.
-try:
-    asyncio.get_running_loop()
-except RuntimeError:
-    asyncio.set_event_loop(asyncio.new_event_loop())
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+# Seconds between redraws of a streaming answer. Each redraw renders the whole text so far,
+# so redrawing on every token would cost time quadratic in the answer length.
+STREAM_RENDER_INTERVAL = float(os.getenv('STREAM_RENDER_INTERVAL', 0.05))
 
 # Configure the Streamlit page.
 st.set_page_config(
@@ -92,22 +96,17 @@ except Exception as e:
     st.error(f"Failed to load pipeline: {e}")
     pipeline = None
 
-def get_response(model_number: int, query: str, chat_history: list) -> tuple:
+def get_response_stream(model_number: int, query: str):
     """
-    Generate a response using the selected model.
-    Returns a tuple: (answer, follow_up_questions)
+    Start a streaming response using the selected model.
+    Returns a StreamingAnswer; after iterating it, .answer and .follow_up are set.
     """
     try:
-        # Make a clean copy of the chat history to avoid any reference issues
-        history_copy = [dict(msg) for msg in chat_history]
-        answer, follow_ups = pipeline.predict(query, model_number)
-        # Ensure follow_ups is always a list
-        if follow_ups is None:
-            follow_ups = []
+        return pipeline.stream_predict(query, model_number, hedged=st.session_state.get("hedged", False),
+                                       memory=st.session_state["memory"])
     except Exception as e:
         st.error(f"Error generating response: {str(e)}")
-        answer, follow_ups = f"An error occurred: {e}", []
-    return answer, follow_ups
+        return StreamingAnswer.from_result(f"An error occurred: {e}", [])
 
 def render_chat(chat_history):
     """Render the complete chat history."""
@@ -140,13 +139,31 @@ def process_query(query, model_number, chat_placeholder, followup_placeholder):
     # Update the chat display to show the processing state
     chat_placeholder.empty()
     with chat_placeholder.container():
-        render_chat(st.session_state["chat_history"])
+        render_chat(st.session_state["chat_history"][:-1])
+        answer_placeholder = st.empty()
+    answer_placeholder.markdown(
+        "<div class='chat-container assistant'>\n\nProcessing...</div>",
+        unsafe_allow_html=True
+    )
 
-    # Generate the response - use history excluding the "Processing..." message
-    with st.spinner("Processing..."):
-        # Create a copy of chat history without the last message (which is "Processing...")
-        history_for_model = st.session_state["chat_history"][:-1]
-        answer, follow_ups = get_response(model_number, query, history_for_model)
+    # Render tokens as the model produces them
+    stream = get_response_stream(model_number, query)
+    tokens = []
+    last_render = 0.0
+    try:
+        for token in stream:
+            tokens.append(token)
+            now = time.monotonic()
+            if now - last_render >= STREAM_RENDER_INTERVAL:
+                answer_placeholder.markdown(
+                    f"<div class='chat-container assistant'>\n\n{''.join(tokens)}▌</div>",
+                    unsafe_allow_html=True
+                )
+                last_render = now
+        answer, follow_ups = stream.answer, stream.follow_up or []
+    except Exception as e:
+        st.error(f"Error generating response: {str(e)}")
+        answer, follow_ups = ''.join(tokens) or f"An error occurred: {e}", []
 
     # Update the placeholder with the actual response
     st.session_state["chat_history"][-1]["content"] = answer
@@ -226,6 +243,10 @@ def main():
     if "chat_history" not in st.session_state:
         st.session_state["chat_history"] = []
 
+    # What the model sees of the conversation: recent turns plus a bounded summary
+    if "memory" not in st.session_state:
+        st.session_state["memory"] = ConversationMemory()
+
     if "button_key_counter" not in st.session_state:
         st.session_state["button_key_counter"] = 0
 
@@ -244,9 +265,17 @@ def main():
     models = ["Gemini", "Mistral", "Llama"]
     selected_model = st.sidebar.selectbox("Select a Model", models)
     model_number = models.index(selected_model)
+    st.session_state["hedged"] = st.sidebar.checkbox(
+        "Fastest response",
+        help="Also ask a second model if the selected one is slow, and show whichever answers first."
+    )
+
+    if pipeline is not None and pipeline.time_to_first_answer is not None:
+        st.sidebar.caption(f"Time to first answer: {pipeline.time_to_first_answer:.1f}s")
 
     if st.sidebar.button("Clear Chat History"):
         st.session_state["chat_history"] = []
+        st.session_state["memory"].clear()
         st.session_state["followup_to_process"] = None
         st.session_state["current_follow_ups"] = []
         st.rerun()
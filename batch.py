@@ -0,0 +1,30 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+from src.batch_query import BatchRunner, completed_ids, read_questions
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions with the INSIGHT-AI pipeline")
+    parser.add_argument("questions", help='JSONL input, one {"id": ..., "question": ..., "model": ...} per line')
+    parser.add_argument("output", help="JSONL results; rerunning with the same file skips questions already answered")
+    parser.add_argument("--model", type=int, default=0,
+                        help="model for questions without one (0 Gemini, 1 Mistral, 2 Llama)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8],
+                        help="concurrent LLM calls per provider: one number, or one per model in selector order")
+    parser.add_argument("--batch-size", type=int, default=64, help="questions embedded and searched together")
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions, default_model=args.model)
+    done = completed_ids(args.output)
+    todo = [question for question in questions if question['id'] not in done]
+    logging.info(f"{len(todo)} of {len(questions)} questions to answer, {len(questions) - len(todo)} already done")
+    if todo:
+        from pipeline.pipeline import Pipeline
+        pipeline = Pipeline()
+        concurrency = {model: args.concurrency[min(model, len(args.concurrency) - 1)]
+                       for model in {question['model'] for question in todo}}
+        runner = BatchRunner(pipeline, concurrency, batch_size=args.batch_size)
+        print(json.dumps(asyncio.run(runner.run(todo, args.output)), indent=2))
@@ -0,0 +1,221 @@
+import argparse
+import json
+import time
+import numpy as np
+from src.ann_index import IVFIndex, benchmark_recall
+from src.quantization import benchmark_quantization
+from src.vector_store import LocalVectorStore
+
+
+def synthetic_vectors(n_rows, dimension=768, n_topics=200, seed=0):
+    # Clustered unit vectors, closer to real chunk embeddings than uniform noise.
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dimension)).astype(np.float32)
+    vectors = topics[rng.integers(0, n_topics, n_rows)] + rng.normal(0, 0.6, (n_rows, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def run_recall(args):
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic)
+        index = IVFIndex(nlist=args.nlist).build(vectors)
+    else:
+        store = LocalVectorStore()
+        store.load()
+        vectors = store.vectors
+        index = store.ann_index or IVFIndex(nlist=args.nlist).build(vectors)
+    print(f"rows={len(vectors)} nlist={index.nlist}")
+    return benchmark_recall(vectors, index, k=args.k, nprobes=args.nprobe, n_queries=args.queries)
+
+
+def run_quantization(args):
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic)
+    else:
+        store = LocalVectorStore()
+        store.load()
+        vectors = store.vectors
+        # Bytes the configured VECTOR_QUANTIZATION scans per query on this index.
+        print(f"index={json.dumps(store.memory_report())}")
+    print(f"rows={len(vectors)}")
+    return benchmark_quantization(vectors, modes=args.modes, k=args.k, rerank_factors=args.rerank_factor,
+                                  n_queries=args.queries)
+
+
+def run_embedding(args):
+    import itertools
+    from src.load_models import CreateModels, EMBEDDING_MODEL_NAME
+    from src.onnx_embeddings import OnnxEmbeddings, benchmark_throughput, compare_embeddings
+    if args.texts:
+        with open(args.texts, encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()][:args.n]
+    else:
+        store = LocalVectorStore()
+        store.load()
+        texts = [metadata['content'] for metadata in itertools.islice(store.iter_metadata(), args.n)]
+    reference = CreateModels().create_torch_embedding()
+    results = {'texts': len(texts), 'torch': benchmark_throughput(reference, texts)}
+    for quantize in (False, True):
+        candidate = OnnxEmbeddings(EMBEDDING_MODEL_NAME, quantize=quantize, threads=args.threads,
+                                   max_seq_length=args.max_seq_length)
+        results[candidate.model_name] = {**benchmark_throughput(candidate, texts),
+                                         **compare_embeddings(reference, candidate, texts)}
+    return results
+
+
+def run_micro_batch(args):
+    from src.load_models import CreateModels
+    from src.micro_batch import benchmark_micro_batching
+    texts = [f"{question} ({i})" for i, question in enumerate(
+        ["What is Generative AI?", "Explain the bias-variance trade-off", "How do neural networks learn?"] * args.n)][:args.n]
+    return benchmark_micro_batching(CreateModels().create_embedding(), texts, concurrency=args.clients,
+                                    max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000)
+
+
+def legacy_clean(text):
+    # The cleaner as it was before the single-pass rewrite, kept as the baseline.
+    import re
+    import unicodedata
+    text = unicodedata.normalize('NFKC', text)
+    text = re.sub(r'^\d+\s+Chapter\s+\d+\s+.*?\n', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^Section\s+\d+(?:\.\d+)?\s+.*?\n', '', text, flags=re.MULTILINE)
+    text = re.sub(r"```.*?```", "", text, flags=re.DOTALL)
+    text = re.sub(r'[^A-Za-z0-9.,;:\(\)\{\}\[\]\+\-\*/=<>%&\|\^\$#@~\n]', ' ', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+def synthetic_chapters(n_chapters, chapter_chars=200_000, seed=0):
+    # Book-like pages: prose, headings, code blocks and some non-ASCII typography.
+    import random
+    rng = random.Random(seed)
+    words = ("the model learns a function from data by minimizing loss over examples; gradient descent "
+             "updates weights (w = w - lr * grad) until validation error stops improving").split()
+    pieces = [lambda: rng.choice(words) + ' ', lambda: '\n', lambda: 'Section 4.2 Regularization\n',
+              lambda: '```\nmodel.fit(X, y)\n```', lambda: '\u201cquoted\u201d ', lambda: 'e\ufb03cient ']
+    weights = [90, 6, 1, 1, 1, 1]
+    chapters = []
+    for _ in range(n_chapters):
+        parts, size = [], 0
+        while size < chapter_chars:
+            part = rng.choices(pieces, weights)[0]()
+            parts.append(part)
+            size += len(part)
+        chapters.append(''.join(parts))
+    return chapters
+
+
+def run_clean(args):
+    from src.clean_data import DataPreprocessing, clean_text
+    if args.texts:
+        with open(args.texts, encoding='utf-8') as f:
+            texts = f.read().split('\f')
+    else:
+        texts = synthetic_chapters(args.chapters)
+    megabytes = sum(len(text.encode('utf-8')) for text in texts) / 1e6
+    results = {'megabytes': megabytes}
+    # min_chars=0 sends even a small corpus to the pool, so the pool's speedup is what gets measured.
+    for name, clean in (('legacy', lambda: list(map(legacy_clean, texts))),
+                        ('single_pass', lambda: list(map(clean_text, texts))),
+                        (f'single_pass_{args.workers}_workers',
+                         lambda: list(DataPreprocessing.clean_batch(texts, workers=args.workers, min_chars=0)))):
+        start = time.perf_counter()
+        clean()
+        results[f'{name}_mb_per_s'] = megabytes / (time.perf_counter() - start)
+    results['multiprocess_speedup'] = (results[f'single_pass_{args.workers}_workers_mb_per_s']
+                                       / results['single_pass_mb_per_s'])
+    cleaned = list(map(clean_text, texts))
+    results['identical_output'] = (list(map(legacy_clean, texts)) == cleaned
+                                   == list(DataPreprocessing.clean_batch(texts, workers=args.workers, min_chars=0)))
+    return results
+
+
+def run_offline(args):
+    from src.offline_bench import run_offline_benchmark, simple_chunks
+    chunker = simple_chunks
+    if args.chunker == "spacy":
+        from src.chunking import Chunking
+        chunker = Chunking().dynamic_chunking
+    embedding_model = None
+    if args.embedding == "model":
+        from src.load_models import CreateModels
+        embedding_model = CreateModels().create_embedding()
+    report = run_offline_benchmark(n_chapters=args.chapters, chapter_words=args.chapter_words, n_queries=args.queries,
+                                   chunker=chunker, embedding_model=embedding_model, llm_latency=args.llm_latency,
+                                   tokens_per_s=args.tokens_per_s, store_latency=args.store_latency, seed=args.seed)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def run_cold_start(args):
+    from pipeline.pipeline import Pipeline
+    start = time.perf_counter()
+    pipeline = Pipeline()
+    constructed = time.perf_counter() - start
+    pipeline.predict(args.query, args.model)
+    return {'construct_s': constructed, **pipeline.startup_report()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieval benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    recall = subparsers.add_parser("recall", help="recall@k of the IVF index against exact search")
+    recall.add_argument("--synthetic", type=int, default=0, help="benchmark N synthetic vectors instead of the local index")
+    recall.add_argument("--nlist", type=int, default=None)
+    recall.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    recall.add_argument("--k", type=int, default=5)
+    recall.add_argument("--queries", type=int, default=200)
+    quantization = subparsers.add_parser("quantization", help="memory, recall@k and latency of quantized search with re-ranking")
+    quantization.add_argument("--synthetic", type=int, default=0, help="benchmark N synthetic vectors instead of the local index")
+    quantization.add_argument("--modes", nargs="+", default=["float16", "int8"])
+    quantization.add_argument("--rerank-factor", type=int, nargs="+", default=[1, 4, 10])
+    quantization.add_argument("--k", type=int, default=5)
+    quantization.add_argument("--queries", type=int, default=200)
+    embedding = subparsers.add_parser("embedding", help="ONNX / int8 embedding throughput and agreement with PyTorch")
+    embedding.add_argument("--texts", help="file with one text per line (default: chunks of the local index)")
+    embedding.add_argument("--n", type=int, default=512)
+    embedding.add_argument("--threads", type=int, default=None)
+    embedding.add_argument("--max-seq-length", type=int, default=None)
+    micro_batch = subparsers.add_parser("micro-batch", help="query embedding throughput with and without micro-batching")
+    micro_batch.add_argument("--n", type=int, default=512, help="queries per run")
+    micro_batch.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16, 64])
+    micro_batch.add_argument("--max-batch", type=int, default=32)
+    micro_batch.add_argument("--max-wait-ms", type=float, default=5)
+    clean = subparsers.add_parser("clean", help="text cleaning throughput (MB/s): legacy, single pass and multiprocess")
+    clean.add_argument("--texts", help="UTF-8 file of documents separated by form feeds (default: synthetic chapters)")
+    clean.add_argument("--chapters", type=int, default=40)
+    clean.add_argument("--workers", type=int, default=4)
+    offline = subparsers.add_parser("offline", help="end-to-end ingestion and query benchmark against local stand-ins")
+    offline.add_argument("--chapters", type=int, default=200)
+    offline.add_argument("--chapter-words", type=int, default=3000)
+    offline.add_argument("--queries", type=int, default=200)
+    offline.add_argument("--chunker", choices=["simple", "spacy"], default="simple")
+    offline.add_argument("--embedding", choices=["fake", "model"], default="fake",
+                         help="hashed bag-of-words stand-in, or the configured embedding model")
+    offline.add_argument("--llm-latency", type=float, default=0.05, help="fake LLM time to first token in seconds")
+    offline.add_argument("--tokens-per-s", type=float, default=2000)
+    offline.add_argument("--store-latency", type=float, default=0.0, help="added per vector search, e.g. a network hop")
+    offline.add_argument("--seed", type=int, default=0)
+    offline.add_argument("--output", help="also write the JSON report to this file")
+    cold_start = subparsers.add_parser("cold-start", help="time from Pipeline() to the first answer")
+    cold_start.add_argument("--query", default="What is Generative AI?")
+    cold_start.add_argument("--model", type=int, default=0, help="index of the model to ask (0 Gemini, 1 Mistral, 2 Llama)")
+    args = parser.parse_args()
+
+    if args.command == "recall":
+        results = run_recall(args)
+    elif args.command == "quantization":
+        results = run_quantization(args)
+    elif args.command == "embedding":
+        results = run_embedding(args)
+    elif args.command == "micro-batch":
+        results = run_micro_batch(args)
+    elif args.command == "clean":
+        results = run_clean(args)
+    elif args.command == "offline":
+        results = run_offline(args)
+    elif args.command == "cold-start":
+        results = run_cold_start(args)
+    print(json.dumps(results, indent=2))
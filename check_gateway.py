@@ -0,0 +1,238 @@
+"""
+Correctness checks for the provider gateway against fake flaky providers:
+python check_gateway.py prints what each check saw and exits non-zero if one fails.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from src.lazy_models import LazyModels
+from src.provider_gateway import CircuitBreaker, ProviderGateway, ProviderUnavailable, TokenBucket, classify_error
+
+# Short backoff and cooldown keep the checks fast; set before any gateway reads them.
+os.environ.update(PROVIDER_BACKOFF_BASE='0.01', PROVIDER_BREAKER_COOLDOWN='0.3', PROVIDER_CONCURRENCY='32')
+
+
+class ProviderError(Exception):
+    """Provider error carrying an HTTP status, as the LLM clients raise them."""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FlakyChatModel:
+    """
+    Chat model stand-in. `fail(n)` returns the error to raise on the n-th call,
+    or None; with `throttle_above`, calls that overlap more than that many
+    others are rejected with a 429.
+    """
+
+    def __init__(self, fail=None, latency=0.01, throttle_above=None):
+        self.fail = fail or (lambda n: None)
+        self.latency = latency
+        self.throttle_above = throttle_above
+        self.calls = 0
+        self.active = 0
+        self.peak = 0
+
+    def _check(self):
+        self.calls += 1
+        error = self.fail(self.calls)
+        if error is not None:
+            raise error
+        if self.throttle_above is not None and self.active > self.throttle_above:
+            raise ProviderError(429)
+
+    def invoke(self, prompt):
+        self._check()
+        time.sleep(self.latency)
+        return prompt
+
+    async def ainvoke(self, prompt):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+            self._check()
+            return prompt
+        finally:
+            self.active -= 1
+
+    def stream(self, prompt):
+        self._check()
+        for word in prompt.split():
+            yield word + ' '
+
+    async def astream(self, prompt):
+        self._check()
+        for word in prompt.split():
+            await asyncio.sleep(0)
+            yield word + ' '
+
+
+def unconfigured():
+    raise ValueError("API key is not set")
+
+
+def gateway(models, **kwargs):
+    return ProviderGateway(LazyModels([lambda model=model: model for model in models]), **kwargs)
+
+
+def check_classify():
+    errors = [ProviderError(429), ProviderError(503), ProviderError(400), Exception('ResourceExhausted: quota'),
+              TimeoutError(), ValueError('bad prompt')]
+    classified = [classify_error(error) for error in errors]
+    return {'classes': classified, 'ok': classified == ['throttled', 'transient', None, 'throttled', 'transient', None]}
+
+
+def check_retry_after_throttle():
+    model = FlakyChatModel(fail=lambda n: ProviderError(429) if n <= 2 else None)
+    answer = gateway([model]).call(0, 'invoke', 'hello')
+    return {'calls': model.calls, 'ok': answer == 'hello' and model.calls == 3}
+
+
+def check_outage_reroute():
+    # Model 0 is down, model 1 has no key; calls move to model 2 once the circuit opens (and report it as the
+    # model that served them), and a probe closes it again.
+    down, backup = FlakyChatModel(fail=lambda n: ProviderError(503)), FlakyChatModel()
+    gw = ProviderGateway(LazyModels([lambda: down, unconfigured, lambda: backup]), max_attempts=1)
+    outcomes, served = [], []
+    for _ in range(8):
+        try:
+            gw.call(0, 'invoke', 'q', on_served=served.append)
+            outcomes.append('answered')
+        except Exception as e:
+            outcomes.append(type(e).__name__)
+    opened = gw.providers[0].breaker.state == CircuitBreaker.OPEN
+    down.fail = lambda n: None
+    time.sleep(0.35)
+    gw.call(0, 'invoke', 'q')
+    closed = gw.providers[0].breaker.state == CircuitBreaker.CLOSED
+    return {'outcomes': outcomes, 'served_by': served, 'failed_model_calls': down.calls,
+            'ok': opened and closed and outcomes[-3:] == ['answered'] * 3 and served == [2] * 3
+            and backup.calls == 3 and down.calls == 6}
+
+
+def check_probe_not_admitted():
+    # A half-open probe turned away by the rate limit must let a later call probe again.
+    down = FlakyChatModel(fail=lambda n: ProviderError(503))
+    gw = gateway([down], max_attempts=1, reroute=False, queue_timeout=0.5)
+    for _ in range(5):
+        try:
+            gw.call(0, 'invoke', 'q')
+        except ProviderError:
+            pass
+    provider = gw.providers[0]
+    provider.requests = TokenBucket(60)
+    provider.requests.reserve(60)
+    time.sleep(0.35)
+    try:
+        gw.call(0, 'invoke', 'q')
+        turned_away = False
+    except ProviderUnavailable:
+        turned_away = True
+    provider.requests = TokenBucket(0)
+    down.fail = lambda n: None
+    answer = gw.call(0, 'invoke', 'q')
+    return {'probe_turned_away': turned_away, 'circuit': provider.breaker.state,
+            'ok': turned_away and answer == 'q' and provider.breaker.state == CircuitBreaker.CLOSED}
+
+
+def check_fail_fast():
+    down = FlakyChatModel(fail=lambda n: ProviderError(503))
+    gw = gateway([down, FlakyChatModel()], max_attempts=1, reroute=False)
+    rejected_ms = []
+    for _ in range(7):
+        start = time.perf_counter()
+        try:
+            gw.call(0, 'invoke', 'q')
+        except ProviderUnavailable:
+            rejected_ms.append((time.perf_counter() - start) * 1000)
+        except ProviderError:
+            pass
+    return {'rejected': len(rejected_ms), 'max_ms': max(rejected_ms, default=None),
+            'ok': len(rejected_ms) == 2 and max(rejected_ms) < 5}
+
+
+def check_token_bucket():
+    bucket = TokenBucket(120)
+    waits = [round(bucket.reserve(40), 2) for _ in range(5)]
+    return {'waits_s': waits, 'ok': waits == [0.0, 0.0, 0.0, 20.0, 40.0]}
+
+
+def check_adaptive_concurrency(n_calls=300, throttle_above=6):
+    model = FlakyChatModel(latency=0.02, throttle_above=throttle_above)
+    gw = gateway([model])
+
+    async def burst():
+        return await asyncio.gather(*[gw.acall(0, 'ainvoke', str(i)) for i in range(n_calls)], return_exceptions=True)
+    start = time.perf_counter()
+    answered = sum(not isinstance(result, Exception) for result in asyncio.run(burst()))
+    limit = gw.providers[0].limit.limit
+    return {'answered': answered, 'calls': n_calls, 'peak_in_flight': model.peak, 'limit': round(limit, 2),
+            'seconds': round(time.perf_counter() - start, 2), 'ok': answered == n_calls and limit <= 2 * throttle_above}
+
+
+def check_stream_retry():
+    model = FlakyChatModel(fail=lambda n: ProviderError(503) if n == 1 else None)
+    gw = gateway([model])
+    streamed = ''.join(gw.stream(0, 'a b c'))
+    abandoned = gw.stream(0, 'a b c')
+    next(abandoned)
+    abandoned.close()
+
+    async def astreams():
+        chunks = [chunk async for chunk in gw.astream(0, 'x y')]
+        iterator = gw.astream(0, 'x y z')
+        await iterator.__anext__()
+        await iterator.aclose()
+        return ''.join(chunks)
+    astreamed = asyncio.run(astreams())
+    in_flight = gw.state()[0]['in_flight']
+    return {'streamed': streamed, 'in_flight': in_flight,
+            'ok': streamed == 'a b c ' and astreamed == 'x y ' and in_flight == 0}
+
+
+def check_cancel_releases_slot():
+    gw = gateway([FlakyChatModel(latency=1.0)])
+
+    async def cancel():
+        task = asyncio.create_task(gw.acall(0, 'ainvoke', 'x'))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    asyncio.run(cancel())
+    in_flight = gw.state()[0]['in_flight']
+    return {'in_flight': in_flight, 'ok': in_flight == 0}
+
+
+CHECKS = {
+    'classify': check_classify,
+    'retry_after_throttle': check_retry_after_throttle,
+    'outage_reroute': check_outage_reroute,
+    'probe_not_admitted': check_probe_not_admitted,
+    'fail_fast': check_fail_fast,
+    'token_bucket': check_token_bucket,
+    'adaptive_concurrency': check_adaptive_concurrency,
+    'stream_retry': check_stream_retry,
+    'cancel_releases_slot': check_cancel_releases_slot,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Provider gateway checks against fake flaky providers")
+    parser.add_argument("checks", nargs="*", help=f"checks to run (default: all): {', '.join(CHECKS)}")
+    args = parser.parse_args()
+    unknown = set(args.checks) - set(CHECKS)
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(sorted(unknown))}")
+    # Failed attempts are logged as warnings by design; only the report matters here.
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'ERROR'))
+    results = {name: CHECKS[name]() for name in args.checks or CHECKS}
+    print(json.dumps(results, indent=2))
+    failed = [name for name, result in results.items() if not result['ok']]
+    if failed:
+        raise SystemExit(f"Failed: {', '.join(failed)}")
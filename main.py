@@ -1,6 +1,15 @@
 from pipeline.pipeline import Pipeline
+import argparse
 import logging
+import os
 if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Build the INSIGHT-AI vector index")
+    parser.add_argument("--compact-embeddings", action="store_true",
+                        help="after training, drop cached embeddings of chunks no longer in the index")
+    args = parser.parse_args()
     logging.debug("Running")
     pipeline = Pipeline()
-    pipeline.train()
\ No newline at end of file
+    pipeline.train()
+    if args.compact_embeddings:
+        print(f"Dropped {pipeline.compact_embeddings()} cached embeddings")
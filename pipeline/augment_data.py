@@ -1,22 +1,69 @@
+from functools import lru_cache
 from src.augument_prompt import AugmentPrompt
+from src.context_compression import compress_contexts, dedupe_contexts
+from src.embedding_batcher import content_hash
+from src.embedding_store import EmbeddingStore
+from src.load_models import EMBEDDING_MODEL_NAME
+from src.metrics import span
+
+
+@lru_cache(maxsize=2)
+def _embedding_store(model_name):
+    return EmbeddingStore(model_name)
 
 
 class AugmentPromptPipeline:
-    def __init__(self, embedding_model, query, k=3):
+    def __init__(self, embedding_model, query, k=5, store=None, token_budget=None, chat_history=None):
         self.k = k
+        self.token_budget = token_budget
+        self.chat_history = chat_history or []
         self.query = query
         self.embedding_model = embedding_model
         self.pc_name = "ai-chatbot"
+        self.store = store
+
+    def start_augment_prompt(self, embedding=None):
+        augmentprompt_obj = AugmentPrompt(
+            query=self.query, embedding_model=self.embedding_model, k=self.k, store=self.store)
+        augmentprompt_obj.load_vector_db()
+        contexts, scores = augmentprompt_obj.extract_contexts(embedding)
+        return self._build_prompt(augmentprompt_obj, contexts, scores)
 
-    def start_augment_prompt(self):
+    async def astart_augment_prompt(self, embedding=None):
         augmentprompt_obj = AugmentPrompt(
-            query=self.query, embedding_model=self.embedding_model)
+            query=self.query, embedding_model=self.embedding_model, k=self.k, store=self.store)
         augmentprompt_obj.load_vector_db()
-        contexts, scores = augmentprompt_obj.extract_contexts()
-        contexts = [context for idx, context in enumerate(
-            contexts) if scores[idx] >= 0.3]
-        if contexts:
-            augment_prompt = augmentprompt_obj.augment_prompt(contexts)
+        contexts, scores = await augmentprompt_obj.aextract_contexts(embedding)
+        return self._build_prompt(augmentprompt_obj, contexts, scores)
+
+    def augment_from_results(self, results):
+        # For results already fetched, e.g. by a batched vector search.
+        augmentprompt_obj = AugmentPrompt(
+            query=self.query, embedding_model=self.embedding_model, k=self.k, store=self.store)
+        contexts, scores = augmentprompt_obj._to_documents(results)
+        return self._build_prompt(augmentprompt_obj, contexts, scores)
+
+    def _build_prompt(self, augmentprompt_obj, contexts, scores):
+        with span('score_filter'):
+            kept = [(context, score) for context, score in zip(contexts, scores) if score >= 0.3]
+        if kept:
+            contexts = self._postprocess([context for context, _ in kept], [score for _, score in kept])
+            with span('prompt_format'):
+                augment_prompt = augmentprompt_obj.augment_prompt(
+                    contexts, chat_history=self.chat_history, token_budget=self.token_budget)
         else:
             augment_prompt = None
         return augment_prompt
+
+    def _postprocess(self, contexts, scores):
+        # Near-duplicate chunks are dropped, then each remaining chunk keeps its most query-relevant sentences.
+        with span('context_dedup'):
+            contexts, scores = dedupe_contexts(contexts, scores, self._context_embeddings(contexts))
+        with span('context_compression'):
+            return compress_contexts(self.query, contexts)
+
+    def _context_embeddings(self, contexts):
+        # Chunk vectors persisted at ingestion, looked up by content hash; chunks without one fall back to shingles.
+        store = _embedding_store(getattr(self.embedding_model, 'model_name', EMBEDDING_MODEL_NAME))
+        texts = {content_hash(context.page_content): context.page_content for context in contexts}
+        return {texts[key]: embedding for key, embedding in store.get_many(list(texts)).items()}
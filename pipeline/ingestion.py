@@ -0,0 +1,15 @@
+from src.ingestion import IngestionEngine
+from src.load_data import DataIngestion
+
+
+class IngestionPipeline:
+    def __init__(self, embedding_model, store, workers=None):
+        self.embedding_model = embedding_model
+        self.store = store
+        self.workers = workers
+
+    def start_ingestion(self):
+        pdf_paths = DataIngestion().list_pdfs()
+        self.store.create()
+        engine = IngestionEngine(self.embedding_model, self.store, workers=self.workers)
+        return engine.run(pdf_paths)
@@ -1,3 +1,5 @@
+from src.context_packing import count_tokens
+from src.lazy_models import BackgroundModel, LazyModels
 from src.load_models import CreateModels
 
 
@@ -10,9 +12,21 @@ class CreateModelPipeline:
         embedding_model = create_models.create_embedding()
         return embedding_model
 
+    def start_embedding_model_async(self, warmup=True):
+        """
+        Load the embedding model on a background thread and warm it up with one
+        query; the prompt tokenizer is loaded on the same thread.
+        """
+        def load():
+            embedding_model = self.start_embedding_model()
+            if warmup:
+                # The first encode pays for kernel selection and allocator growth; do it before a user does.
+                embedding_model.embed_query("warm up")
+                count_tokens("warm up")
+            return embedding_model
+        return BackgroundModel(load, name="embedding-loader")
+
     def start_llm_model(self):
         create_models = CreateModels()
-        gemini_model = create_models.create_gemini()
-        mistral_model = create_models.create_deepseek()
-        llama_model = create_models.create_llama()
-        return gemini_model, mistral_model,llama_model
+        # Each client is created the first time its model is selected.
+        return LazyModels([create_models.create_gemini, create_models.create_deepseek, create_models.create_llama])
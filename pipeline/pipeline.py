@@ -1,69 +1,329 @@
+import asyncio
 import logging
-import re
-from .load_data import DataIngestionPipeline
-from .clean_data import DataPreProcessingPipeline
+import os
+import threading
+import time
+from functools import partial
 from .load_model import CreateModelPipeline
-from .vector_db import CreateVectorDBPipeline
 from .augment_data import AugmentPromptPipeline
-from .extract_data import ExtractDataPipeline
+from src.vector_store import load_vector_store
+from src.embedding_cache import CachedEmbeddings
+from src.micro_batch import MicroBatchEmbedder
+from src.lazy_models import BackgroundModel, LazyModels
+from src.answer_cache import SemanticAnswerCache
+from src.load_models import EMBEDDING_MODEL_NAME
+from src.embedding_store import EmbeddingStore
+from src.embedding_batcher import content_hash
+from src.response_parser import StreamingAnswer, chunk_text, iter_async, parse_response
+from src.hedged import HedgedGenerator
+from src.provider_gateway import ProviderGateway
+from src.context_packing import context_budget
+from src.conversation_memory import memory_budget
+from src.metrics import observe_stage, span_labels, span, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+NO_CONTEXT_RESPONSE = ("I don't know about this topic. You can try these topics", ["What is Generative AI",
+                       "Explain about bias-variance trade-off","Explain neural networks."])
+
+
 class Pipeline:
-    def __init__(self):
-        print("Embedding Loading")
+    def __init__(self, embedding_model=None, llms=None, store=None):
+        """
+        Models and store are created from the environment unless given, which
+        lets benchmarks run the query path against local stand-ins.
+        """
+        self.started = time.perf_counter()
+        self.time_to_first_answer = None
+        logger.info("Embedding Loading")
         self.model_pipeline = CreateModelPipeline()
-        self.embedding_model = self.model_pipeline.start_embedding_model()
-        self.llms = self.model_pipeline.start_llm_model()
-        print("Embedding Loaded")
+        # The embedding model loads (and warms up) in the background while the index is opened;
+        # LLM clients are built on first selection.
+        if embedding_model is None:
+            self.embedding_loader = self.model_pipeline.start_embedding_model_async()
+        else:
+            self.embedding_loader = BackgroundModel(lambda: embedding_model)
+        if llms is None:
+            self.llms = self.model_pipeline.start_llm_model()
+        else:
+            self.llms = LazyModels([lambda llm=llm: llm for llm in llms])
+        if store is None:
+            store = load_vector_store()
+            store.load()
+        self.store = store
+        self.answer_cache = SemanticAnswerCache()
+        # Chunks retrieved per query, the same for interactive and batched queries.
+        self.k = int(os.getenv('RETRIEVAL_K', 5))
+        self.hedger = HedgedGenerator()
+        # Every session's LLM calls share the gateway's rate limits, retry budget and circuit breakers.
+        self.gateway = ProviderGateway(self.llms)
+        self._query_embedding = None
+        self._query_embedding_lock = threading.Lock()
+        start_metrics_server()
+
+    @property
+    def embedding_model(self):
+        return self.embedding_loader.get()
+
+    @property
+    def query_embedding(self):
+        # Queries go through the cache, and misses from concurrent sessions are embedded
+        # together by one micro-batcher; ingestion keeps using the raw model.
+        if self._query_embedding is None:
+            embedding_model = self.embedding_model
+            with self._query_embedding_lock:
+                if self._query_embedding is None:
+                    logger.info("Embedding Loaded")
+                    self._query_embedding = CachedEmbeddings(
+                        MicroBatchEmbedder(embedding_model),
+                        getattr(embedding_model, 'model_name', EMBEDDING_MODEL_NAME))
+        return self._query_embedding
+
+    async def aquery_embedding(self):
+        """query_embedding for coroutines: a cold start waits for the model in a thread, not on the event loop."""
+        if self._query_embedding is None:
+            return await asyncio.to_thread(getattr, self, 'query_embedding')
+        return self._query_embedding
+
+    def _answered(self):
+        if self.time_to_first_answer is None:
+            self.time_to_first_answer = time.perf_counter() - self.started
+            logger.info(f"Time to first answer: {self.time_to_first_answer:.2f}s")
+
+    def startup_report(self):
+        """Seconds spent loading the embedding model and each LLM client, and until the first answer."""
+        return {'embedding_load_s': self.embedding_loader.load_seconds,
+                'llm_build_s': dict(self.llms.build_seconds),
+                'time_to_first_answer_s': self.time_to_first_answer}
 
     def train(self):
-        print("Data Ingestion Started")
-        data_ingestion_pipeline = DataIngestionPipeline()
-        pdf_document = data_ingestion_pipeline.start_ingestion()
-        print("Data Ingestion Completed")
-        print("Data Preprocessing Started")
-        extract_data_pipeline = ExtractDataPipeline()
-        print("Data Preprocessing Completed")
-        print("Data Extraction Started")
-        extracted_data = extract_data_pipeline.start_extraction(pdf_document)
-        data_cleaning_pipeline = DataPreProcessingPipeline()
-        cleaned_data = data_cleaning_pipeline.start_cleaning(extracted_data)
-        print("Data Extraction Completed")
-        print("Data Preprocessing Completed")
-        print("Vector Database Creation..")
-        vector_db_pipeline = CreateVectorDBPipeline(embedding_model=self.embedding_model)
-        vector_db_pipeline.start_vectordb(cleaned_data)
-        print("Vector Database Creation Completed")
-
-
-    def predict(self,query,selected_model_idx):
-        augmnet_query_pipeline = AugmentPromptPipeline(embedding_model=self.embedding_model,k=3,query=query)
-        augmnet_query = augmnet_query_pipeline.start_augment_prompt()
+        # Imported here so that serving never loads spaCy or the PDF parsers.
+        from .ingestion import IngestionPipeline
+        logger.info("Ingestion Started")
+        ingestion_pipeline = IngestionPipeline(embedding_model=self.embedding_model, store=self.store)
+        stats = ingestion_pipeline.start_ingestion()
+        self.answer_cache.clear()
+        logger.info(f"Ingestion Completed: {stats}")
+
+    def compact_embeddings(self):
+        # Keep only embeddings whose chunk text is still referenced by the index.
+        store = EmbeddingStore(getattr(self.embedding_model, 'model_name', EMBEDDING_MODEL_NAME))
+        keep = [content_hash(metadata['content']) for metadata in self.store.iter_metadata()]
+        return store.compact(keep_hashes=keep)
+
+
+    def _cached_answer(self, query_embedding, selected_model_idx, memory):
+        # The enclosing request span is labelled with the answer cache outcome. Answers that
+        # build on earlier turns of a conversation are neither served from nor stored in the cache.
+        labels = span_labels()
+        cached = None if memory else self.answer_cache.get(query_embedding, selected_model_idx)
+        labels['cache'] = 'miss' if cached is None else 'hit'
+        return cached
+
+    def _augment_pipeline(self, query, selected_model_idx, memory):
+        chat_history = memory.messages(memory_budget(selected_model_idx)) if memory else []
+        return AugmentPromptPipeline(embedding_model=self.query_embedding,k=self.k,query=query,store=self.store,
+                                     token_budget=context_budget(selected_model_idx), chat_history=chat_history)
+
+    def _finish(self, query, query_embedding, selected_model_idx, answer, follow_up, memory, cache=True):
+        if cache and not memory:
+            self.answer_cache.put(query_embedding, selected_model_idx, answer, follow_up)
+        if memory is not None:
+            memory.add(query, answer)
+        self._answered()
+        return answer, follow_up
+
+    def _augment(self, query, selected_model_idx, memory=None):
+        with span('query_embedding') as labels:
+            query_embedding, embedding_cached = self.query_embedding.lookup(query)
+            labels['cache'] = 'hit' if embedding_cached else 'miss'
+        cached = self._cached_answer(query_embedding, selected_model_idx, memory)
+        if cached is not None:
+            return query_embedding, cached, None
+        augmnet_query = self._augment_pipeline(query, selected_model_idx, memory).start_augment_prompt(query_embedding)
         if not augmnet_query:
-            return "I don't know about this topic. You can try these topics", ["What is Generative AI",
-            "Explain about bias-variance trade-off","Explain neural networks."]
-        print("Aguemneted Promt")
-        print("-"*100)
-        # print(scores,augmnet_query)
-        print(f'before model {selected_model_idx}')
-        response = self.llms[selected_model_idx].invoke(augmnet_query)
-        print(response)
-        if selected_model_idx ==  0:
-            text = response.text()
-        elif selected_model_idx == 1:
-            text = response.content
-        else:
-            text = response
-        parts = text.split('Follow up questions:')
-        print(len(parts))
-        if len(parts) < 2:
-            # Log an error or handle gracefully
-            answer = text
-            follow_up = []
+            return query_embedding, NO_CONTEXT_RESPONSE, None
+        logger.debug("Augmented prompt built")
+        return query_embedding, None, augmnet_query
+
+    def _parse(self, response):
+        with span('parse_follow_up'):
+            return parse_response(chunk_text(response))
+
+    def predict(self,query,selected_model_idx,memory=None):
+        """
+        Answer `query` with the selected model. With a ConversationMemory the
+        prompt includes the earlier turns, and the new turn is added to it.
+        """
+        with span('predict', model=selected_model_idx):
+            query_embedding, cached, augmnet_query = self._augment(query, selected_model_idx, memory)
+            if cached is not None:
+                return self._finish(query, query_embedding, selected_model_idx, *cached, memory, cache=False)
+            logger.debug(f"Calling model {selected_model_idx}")
+            with span('llm_total') as labels:
+                served = {'model': selected_model_idx}
+                response = self._llm(selected_model_idx).invoke(augmnet_query,
+                                                                on_served=partial(_record_served, served, labels))
+            logger.debug(f"Raw response: {response}")
+            answer, follow_up = self._parse(response)
+            logger.debug(f"Follow-up questions: {follow_up}")
+            # A rerouted answer is cached under the model that wrote it, as hedged answers are.
+            return self._finish(query, query_embedding, served['model'], answer, follow_up, memory)
+
+    def _llm(self, selected_model_idx):
+        return self.gateway[selected_model_idx]
+
+    async def _alookup(self, query):
+        query_embedding = await self.aquery_embedding()
+        return await query_embedding.alookup(query)
+
+    async def _aaugment(self, query, selected_model_idx, memory=None):
+        with span('query_embedding') as labels:
+            (query_embedding, embedding_cached), llm = await asyncio.gather(
+                self._alookup(query),
+                asyncio.to_thread(self._llm, selected_model_idx),
+            )
+            labels['cache'] = 'hit' if embedding_cached else 'miss'
+        cached = self._cached_answer(query_embedding, selected_model_idx, memory)
+        if cached is not None:
+            return query_embedding, cached, None
+        augmnet_query = await self._augment_pipeline(query, selected_model_idx, memory).astart_augment_prompt(
+            query_embedding)
+        if not augmnet_query:
+            return query_embedding, NO_CONTEXT_RESPONSE, None
+        return query_embedding, None, augmnet_query
+
+    async def apredict(self, query, selected_model_idx, memory=None):
+        """Async predict: embedding and model setup overlap, the LLM call uses the async client."""
+        with span('predict', model=selected_model_idx):
+            prepared = await self._aaugment(query, selected_model_idx, memory)
+            return await self.acomplete(query, selected_model_idx, prepared, memory)
+
+    async def acomplete(self, query, selected_model_idx, prepared, memory=None):
+        """Answer a query from its (query_embedding, cached, prompt), as returned by augment_batch."""
+        query_embedding, cached, augmnet_query = prepared
+        if cached is not None:
+            return self._finish(query, query_embedding, selected_model_idx, *cached, memory, cache=False)
+        with span('llm_total', model=selected_model_idx) as labels:
+            served = {'model': selected_model_idx}
+            response = await self._llm(selected_model_idx).ainvoke(augmnet_query,
+                                                                   on_served=partial(_record_served, served, labels))
+        answer, follow_up = self._parse(response)
+        return self._finish(query, query_embedding, served['model'], answer, follow_up, memory)
+
+    def augment_batch(self, queries, selected_model_idx):
+        """
+        Prepare many queries at once: embedding cache misses go to the model in
+        one call and the index is searched with all embeddings together.
+        Returns a (query_embedding, cached, prompt) per query for acomplete.
+        """
+        with span('augment', model=selected_model_idx):
+            with span('query_embedding'):
+                embeddings = [embedding for embedding, _ in self.query_embedding.lookup_many(queries)]
+            with span('vector_search'):
+                results = self.store.query_many(embeddings, k=self.k)
+            prepared = []
+            for query, query_embedding, found in zip(queries, embeddings, results):
+                cached = self.answer_cache.get(query_embedding, selected_model_idx)
+                augmnet_query = None
+                if cached is None:
+                    augmnet_query = AugmentPromptPipeline(
+                        embedding_model=self.query_embedding,k=self.k,query=query,store=self.store,
+                        token_budget=context_budget(selected_model_idx)).augment_from_results(found)
+                    if not augmnet_query:
+                        cached = NO_CONTEXT_RESPONSE
+                prepared.append((query_embedding, cached, augmnet_query))
+            return prepared
+
+    def _secondary(self, selected_model_idx):
+        return (selected_model_idx + 1) % len(self.llms)
+
+    # The hedged paths resolve a model's client only when that model is actually asked, so an
+    # unusable secondary (e.g. a missing API key) costs nothing until the hedge delay expires.
+    # `served` maps each hedged model to the one that answered for it after a reroute.
+    async def _ainvoke(self, selected_model_idx, prompt, served):
+        llm = await asyncio.to_thread(self._llm, selected_model_idx)
+        return await llm.ainvoke(prompt, on_served=partial(served.__setitem__, selected_model_idx))
+
+    async def _astream(self, selected_model_idx, prompt, served):
+        llm = await asyncio.to_thread(self._llm, selected_model_idx)
+        chunks = llm.astream(prompt, on_served=partial(served.__setitem__, selected_model_idx))
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            if hasattr(chunks, 'aclose'):
+                await chunks.aclose()
+
+    async def apredict_fastest(self, query, selected_model_idx, secondary_model_idx=None, memory=None):
+        """
+        Hedged predict: the selected model gets the prompt first and the secondary
+        one only if the first is slower than the hedge delay; the first answer wins.
+        """
+        if secondary_model_idx is None:
+            secondary_model_idx = self._secondary(selected_model_idx)
+        with span('predict', model=selected_model_idx):
+            query_embedding, cached, augmnet_query = await self._aaugment(query, selected_model_idx, memory)
+            if cached is not None:
+                return self._finish(query, query_embedding, selected_model_idx, *cached, memory, cache=False)
+            served = {}
+            calls = {idx: partial(self._ainvoke, idx, augmnet_query, served)
+                     for idx in (selected_model_idx, secondary_model_idx)}
+            with span('llm_total') as labels:
+                winner, response = await self.hedger.generate(calls, selected_model_idx, secondary_model_idx)
+                model = served.get(winner, winner)
+                labels['model'] = str(model)
+            logger.info(f"Hedged generation answered by model {model}")
+            answer, follow_up = self._parse(response)
+            # Cached under the model that wrote the answer, not the one that was asked.
+            return self._finish(query, query_embedding, model, answer, follow_up, memory)
+
+    def stream_predict(self, query, selected_model_idx, hedged=False, memory=None):
+        """
+        Like predict, but returns a StreamingAnswer that yields tokens as the model
+        produces them. With hedged=True the first model to start streaming wins.
+        """
+        started = time.perf_counter()
+        with span('augment', model=selected_model_idx) as labels:
+            query_embedding, cached, augmnet_query = self._augment(query, selected_model_idx, memory)
+        if cached is not None:
+            observe_stage('predict', time.perf_counter() - started, **labels)
+            return StreamingAnswer.from_result(
+                *self._finish(query, query_embedding, selected_model_idx, *cached, memory, cache=False))
+
+        # The LLM stages are labelled with the model that streams the answer, which a hedge or reroute can change.
+        answered_by = {'model': selected_model_idx}
+        llm_labels = dict(labels)
+        on_served = partial(_record_served, answered_by, llm_labels)
+
+        def on_complete(answer, follow_up):
+            observe_stage('predict', time.perf_counter() - started, **labels)
+            self._finish(query, query_embedding, answered_by['model'], answer, follow_up, memory)
+
+        if hedged:
+            secondary_model_idx = self._secondary(selected_model_idx)
+            served = {}
+            streams = {idx: partial(self._astream, idx, augmnet_query, served)
+                       for idx in (selected_model_idx, secondary_model_idx)}
+            chunks = iter_async(self.hedger.stream(streams, selected_model_idx, secondary_model_idx,
+                                                   on_winner=lambda winner: on_served(served.get(winner, winner))))
         else:
-            follow_up = parts[1].split('?')
-            answer = parts[0] + " ".join(follow_up[-1])
-            follow_up = [re.sub(r'^\s*\d+\.\s*', '', text) for text in follow_up]
+            chunks = self._llm(selected_model_idx).stream(augmnet_query, on_served=on_served)
+        return StreamingAnswer(_timed_stream(chunks, llm_labels), on_complete=on_complete)
+
 
-        print(follow_up)
+def _record_served(served, labels, model_idx):
+    served['model'] = model_idx
+    labels['model'] = str(model_idx)
 
-        return answer,follow_up
 
+def _timed_stream(chunks, labels):
+    # Streams are consumed outside any span, so the LLM stages are observed by hand.
+    start = time.perf_counter()
+    first = True
+    for chunk in chunks:
+        if first:
+            observe_stage('llm_first_token', time.perf_counter() - start, **labels)
+            first = False
+        yield chunk
+    observe_stage('llm_total', time.perf_counter() - start, **labels)
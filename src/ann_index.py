@@ -0,0 +1,183 @@
+import json
+import os
+import time
+import numpy as np
+
+
+class IVFIndex:
+    """
+    Inverted-file index over L2-normalized vectors. A spherical k-means coarse
+    quantizer splits the rows into `nlist` lists; a query scans only the rows of
+    its `nprobe` closest lists. The index stores row ids, never a copy of the
+    vectors, so it is scored against the store's own memory-mapped matrix.
+    """
+
+    def __init__(self, nlist=None, nprobe=8, n_iter=20, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.centroids = None
+        self.list_rows = None
+        self.offsets = None
+
+    @property
+    def ntotal(self):
+        return 0 if self.list_rows is None else len(self.list_rows)
+
+    def build(self, vectors):
+        n_rows = len(vectors)
+        nlist = self.nlist or max(1, int(4 * np.sqrt(n_rows)))
+        nlist = min(nlist, n_rows)
+        rng = np.random.default_rng(self.seed)
+        # Train on a sample; 256 points per list is plenty for a coarse quantizer.
+        sample_size = min(n_rows, 256 * nlist)
+        sample = np.asarray(vectors[np.sort(rng.choice(n_rows, sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assign = _assign(sample, centroids)
+            counts = np.bincount(assign, minlength=nlist)
+            # Sum members per list with one sorted reduceat instead of a scattered add.
+            order = np.argsort(assign, kind='stable')
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.zeros_like(centroids)
+            non_empty = counts > 0
+            sums[non_empty] = np.add.reduceat(sample[order], starts[non_empty], axis=0)
+            empty = counts == 0
+            # Re-seed empty lists from random sample points.
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = _normalize(sums)
+        assign = _assign(vectors, centroids)
+        self.centroids = centroids
+        self.list_rows = np.argsort(assign, kind='stable').astype(np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+        self.nlist = nlist
+        return self
+
+    def candidates(self, query, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = self.centroids @ query
+        lists = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self.list_rows[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+
+    def search(self, vectors, query, k, nprobe=None):
+        rows = self.candidates(query, nprobe)
+        if len(rows) == 0:
+            return rows, np.zeros(0, dtype=np.float32)
+        rows.sort()  # sequential reads from the memory-mapped matrix
+        scores = vectors[rows] @ query
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return rows[top], scores[top]
+
+    def save(self, index_dir, build_id=None):
+        """
+        Write the arrays under names stamped with `build_id` (the vectors'
+        generation), then ivf.json naming that build. Files are never rewritten
+        in place, so a reader that has mapped an older build is unaffected.
+        """
+        for name, array in (('ivf_centroids.npy', self.centroids), ('ivf_list_rows.npy', self.list_rows),
+                            ('ivf_offsets.npy', self.offsets)):
+            path = _stamped_path(index_dir, name, build_id)
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(path + '.tmp', path)
+        config_path = os.path.join(index_dir, 'ivf.json')
+        with open(config_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'nlist': self.nlist, 'ntotal': self.ntotal, 'build_id': build_id}, f)
+        os.replace(config_path + '.tmp', config_path)
+
+    @classmethod
+    def load(cls, index_dir, nprobe=8, build_id=None):
+        """The saved index for `build_id`, or None if there is none or it belongs to another build."""
+        config_path = os.path.join(index_dir, 'ivf.json')
+        if not os.path.exists(config_path):
+            return None
+        with open(config_path, encoding='utf-8') as f:
+            config = json.load(f)
+        if config.get('build_id') != build_id:
+            return None
+        index = cls(nlist=config['nlist'], nprobe=nprobe)
+        try:
+            index.centroids = np.load(_stamped_path(index_dir, 'ivf_centroids.npy', build_id))
+            index.list_rows = np.load(_stamped_path(index_dir, 'ivf_list_rows.npy', build_id), mmap_mode='r')
+            index.offsets = np.load(_stamped_path(index_dir, 'ivf_offsets.npy', build_id))
+        except FileNotFoundError:
+            # A newer build replaced this one between reading ivf.json and its arrays.
+            return None
+        if index.ntotal != config['ntotal'] or len(index.offsets) != index.nlist + 1:
+            return None
+        return index
+
+
+def _stamped_path(index_dir, name, build_id):
+    # Files written before builds were stamped use the bare name.
+    stem, ext = os.path.splitext(name)
+    return os.path.join(index_dir, f'{stem}-{build_id}{ext}' if build_id else name)
+
+
+def _assign(vectors, centroids, chunk_size=65536):
+    assign = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        assign[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+    return assign
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def exact_search(vectors, query, k):
+    scores = np.asarray(vectors @ query)
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def exact_search_many(vectors, queries, k, chunk_size=65536):
+    """Top-k rows and scores for every query in one pass over `vectors`, instead of one pass per query."""
+    queries = np.asarray(queries, dtype=np.float32)
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(vectors), chunk_size):
+        scores = np.asarray(vectors[start:start + chunk_size], dtype=np.float32) @ queries.T
+        rows = np.broadcast_to(np.arange(start, start + len(scores)), (len(queries), len(scores)))
+        best_rows = np.concatenate([best_rows, rows], axis=1)
+        best_scores = np.concatenate([best_scores, scores.T], axis=1)
+        if best_scores.shape[1] > k:
+            top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_rows = np.take_along_axis(best_rows, top, axis=1)
+            best_scores = np.take_along_axis(best_scores, top, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def benchmark_recall(vectors, index, k=5, nprobes=(1, 2, 4, 8, 16, 32), n_queries=200, noise=0.05, seed=0):
+    """
+    Measure recall@k of `index` against exact search for each nprobe. Queries
+    are stored vectors with Gaussian noise, which mimics paraphrased questions
+    landing near an indexed chunk. Returns one dict per operating point.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    queries = np.asarray(vectors[np.sort(rows)], dtype=np.float32)
+    queries = _normalize(queries + rng.normal(0, noise, queries.shape).astype(np.float32))
+
+    start = time.perf_counter()
+    truth = [set(exact_search(vectors, q, k).tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    results = []
+    for nprobe in nprobes:
+        hits = 0
+        start = time.perf_counter()
+        for q, expected in zip(queries, truth):
+            found, _ = index.search(vectors, q, k, nprobe=nprobe)
+            hits += len(expected.intersection(found.tolist()))
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        results.append({'nprobe': nprobe, f'recall@{k}': hits / (k * len(queries)),
+                        'latency_ms': latency_ms, 'exact_latency_ms': exact_ms})
+    return results
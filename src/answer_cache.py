@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+import numpy as np
+from src.vector_store import index_version
+
+
+class SemanticAnswerCache:
+    """
+    Cache of (answer, follow_up) pairs looked up by query-embedding similarity,
+    kept separately per model. Entries expire after `ttl` seconds, the least
+    recently used entry is evicted beyond `max_entries` per model, and the whole
+    cache is dropped whenever the vector index is rebuilt.
+    """
+
+    def __init__(self, threshold=None, ttl=None, max_entries=None):
+        self.threshold = threshold or float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.9))
+        self.ttl = ttl or float(os.getenv('ANSWER_CACHE_TTL', 24 * 3600))
+        self.max_entries = max_entries or int(os.getenv('ANSWER_CACHE_SIZE', 512))
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.version = index_version()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            self.version = index_version()
+
+    def _check_version(self):
+        version = index_version()
+        if version != self.version:
+            self.entries = {}
+            self.version = version
+
+    def get(self, embedding, model_idx):
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), 1e-12)
+        now = time.time()
+        with self.lock:
+            self._check_version()
+            entries = [entry for entry in self.entries.get(model_idx, []) if now - entry['created'] < self.ttl]
+            self.entries[model_idx] = entries
+            if entries:
+                scores = np.stack([entry['embedding'] for entry in entries]) @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entries[best]['last_used'] = now
+                    self.hits += 1
+                    return entries[best]['answer'], list(entries[best]['follow_up'])
+            self.misses += 1
+            return None
+
+    def put(self, embedding, model_idx, answer, follow_up):
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), 1e-12)
+        now = time.time()
+        with self.lock:
+            self._check_version()
+            entries = self.entries.setdefault(model_idx, [])
+            entries.append({'embedding': query, 'answer': answer,
+                            'follow_up': list(follow_up), 'created': now, 'last_used': now})
+            if len(entries) > self.max_entries:
+                entries.sort(key=lambda entry: entry['last_used'])
+                del entries[:len(entries) - self.max_entries]
@@ -1,43 +1,77 @@
-import os
 from langchain.prompts.chat import (
     ChatPromptTemplate,
     HumanMessagePromptTemplate,
     MessagesPlaceholder,
 )
-from langchain.schema import SystemMessage
-from langchain_pinecone.vectorstores import PineconeVectorStore
-from pinecone import Pinecone
+from langchain.schema import Document, SystemMessage
+import logging
+from functools import lru_cache
+from src.context_packing import context_budget, pack_contexts
+from src.metrics import span
+from src.vector_store import load_vector_store
+
+logger = logging.getLogger(__name__)
 
 
 class AugmentPrompt:
-    def __init__(self, embedding_model,query, k=5):
+    def __init__(self, embedding_model,query, k=5, store=None):
         self.k = k
         self.query =query
         self.embedding_model = embedding_model
         self.pc_name = "ai-chatbot"
+        self.store = store
 
     def load_vector_db(self):
-        # Load the Pinecone index using the API key stored in environment variables.
-        self.pc_index = Pinecone(os.getenv('PINECONE_API')).Index(self.pc_name)
+        # Load the configured vector store (Pinecone or the local index, see VECTOR_STORE).
+        if self.store is None:
+            self.store = load_vector_store(index_name=self.pc_name)
+            self.store.load()
 
-    def extract_contexts(self):
+    def extract_contexts(self, embedding=None):
         # Use the vector store to fetch the top-k most relevant information for the query.
-        vectorstore = PineconeVectorStore(
-            self.pc_index, embedding=self.embedding_model, text_key='content'
-        )
-        results = vectorstore.similarity_search_with_score(query=self.query, k=self.k)
-        print(results)
-        contexts, scores = map(list, zip(*results))
+        # Callers that already embedded the query pass the vector in.
+        if embedding is None:
+            embedding = self.embedding_model.embed_query(self.query)
+        with span('vector_search'):
+            results = self.store.query(embedding, k=self.k)
+        return self._to_documents(results)
+
+    async def aextract_contexts(self, embedding=None):
+        if embedding is None:
+            embedding = await self.embedding_model.aembed_query(self.query)
+        with span('vector_search'):
+            results = await self.store.aquery(embedding, k=self.k)
+        return self._to_documents(results)
+
+    def _to_documents(self, results):
+        logger.debug(f"Retrieved {len(results)} contexts, scores {[round(score, 3) for _, score in results]}")
+        if not results:
+            return [], []
+        contexts = []
+        scores = []
+        for metadata, score in results:
+            metadata = dict(metadata)
+            content = metadata.pop('content', '')
+            contexts.append(Document(page_content=content, metadata=metadata))
+            scores.append(score)
         return contexts, scores
 
-    def augment_prompt(self, contexts, chat_history=[]):
-        # Define a system message that instructs the chatbot to produce a detailed,
-        # well-structured, and comprehensive response, integrating all supplementary information
-        # seamlessly without referencing its external origin.
+    def augment_prompt(self, contexts, chat_history=[], token_budget=None):
+        # Contexts go in as plain text, best first, packed into the model's token budget.
+        packed = pack_contexts([context.page_content for context in contexts],
+                               token_budget or context_budget())
+        formatted_prompt = chat_prompt_template().format(
+            user_query=self.query,
+            chat_history=chat_history,
+            contexts=packed
+        )
+        return formatted_prompt
+
 
-        system_msg = SystemMessage(
-            content=(
-                """Role:
+# Define a system message that instructs the chatbot to produce a detailed,
+# well-structured, and comprehensive response, integrating all supplementary information
+# seamlessly without referencing its external origin.
+SYSTEM_PROMPT = """Role:
 You are an expert educator in Artificial Intelligence, Machine Learning, and Deep Learning and related topics. Based on the provided contexts give accurate, maximum lengthy well-organized structured explanations that educate users on complex AI topics.
 General Guidelines:
 
@@ -86,27 +120,22 @@ If you lack sufficient information to provide a complete answer, state: "I lack
 Follow up questions:
 At the end add 3 follow up questions based on the query and contexts like this, "Follow up questions: ".
 """
-            )
-        )
 
-        human_msg_template = HumanMessagePromptTemplate.from_template("{user_query}")
 
-        chat_history_placeholder = MessagesPlaceholder(variable_name="chat_history")
+@lru_cache(maxsize=1)
+def chat_prompt_template():
+    # Built once per process; only formatting happens per query.
+    system_msg = SystemMessage(content=SYSTEM_PROMPT)
 
-        user_msg_template = HumanMessagePromptTemplate.from_template("{contexts}")
+    human_msg_template = HumanMessagePromptTemplate.from_template("{user_query}")
 
-        chat_prompt = ChatPromptTemplate.from_messages([
-            system_msg,
-            chat_history_placeholder,
-            human_msg_template,
-            user_msg_template,
-        ])
+    chat_history_placeholder = MessagesPlaceholder(variable_name="chat_history")
 
-        formatted_prompt = chat_prompt.format(
-            user_query=self.query,
-            chat_history=[],
-            contexts = contexts
-    )
-
-        return formatted_prompt
+    user_msg_template = HumanMessagePromptTemplate.from_template("{contexts}")
 
+    return ChatPromptTemplate.from_messages([
+        system_msg,
+        chat_history_placeholder,
+        human_msg_template,
+        user_msg_template,
+    ])
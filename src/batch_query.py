@@ -0,0 +1,112 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def read_questions(path, default_model=0):
+    """Questions from JSONL: {"id", "question", "model"?}; lines without an id are numbered from 1."""
+    questions = []
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            questions.append({'id': str(record.get('id', line_no)),
+                              'question': record.get('question') or record['query'],
+                              'model': int(record.get('model', default_model))})
+    return questions
+
+
+def completed_ids(path):
+    """
+    Ids with an answer in an earlier run's output. A line cut off by a crash is
+    truncated away so that appending starts on a fresh line; failed questions
+    are not counted, so a resumed run retries them.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+            data = data[:data.rfind(b'\n') + 1]
+    done = set()
+    for line in data.decode('utf-8').splitlines():
+        record = json.loads(line)
+        if 'error' not in record:
+            done.add(record['id'])
+    return done
+
+
+class BatchRunner:
+    """
+    Answers question sets through a Pipeline. Questions are prepared in
+    batches of `batch_size` (one embedding call and one index search per batch,
+    see Pipeline.augment_batch) while earlier answers are still being
+    generated; LLM calls run concurrently up to `concurrency[model]` per
+    provider. Each result is appended to the output as soon as it completes.
+    """
+
+    def __init__(self, pipeline, concurrency, batch_size=64):
+        self.pipeline = pipeline
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.answered = 0
+        self.failed = 0
+
+    async def run(self, questions, output_path):
+        semaphores = {model: asyncio.Semaphore(limit) for model, limit in self.concurrency.items()}
+        # Prepared prompts wait for a free slot; two rounds of them keep every provider busy.
+        max_pending = 2 * sum(self.concurrency.values())
+        pending = set()
+        started = time.perf_counter()
+        with open(output_path, 'a', encoding='utf-8') as output:
+            for model in {question['model'] for question in questions}:
+                # Clients are built before the first prompt is waiting on them.
+                await asyncio.to_thread(self.pipeline.llms.__getitem__, model)
+            for start in range(0, len(questions), self.batch_size):
+                batch = questions[start:start + self.batch_size]
+                for model in sorted({question['model'] for question in batch}):
+                    group = [question for question in batch if question['model'] == model]
+                    try:
+                        prepared = await asyncio.to_thread(
+                            self.pipeline.augment_batch, [question['question'] for question in group], model)
+                    except Exception as e:
+                        logger.exception(f"Preparing {len(group)} questions for model {model} failed")
+                        for question in group:
+                            self._write(output, {**question, 'error': str(e)})
+                        continue
+                    for question, item in zip(group, prepared):
+                        pending.add(asyncio.create_task(self._answer(semaphores[model], question, item, output)))
+                while len(pending) >= max_pending:
+                    _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if pending:
+                await asyncio.wait(pending)
+        elapsed = time.perf_counter() - started
+        return {'answered': self.answered, 'failed': self.failed, 'seconds': elapsed,
+                'questions_per_s': (self.answered + self.failed) / elapsed if elapsed else 0.0}
+
+    async def _answer(self, semaphore, question, prepared, output):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                answer, follow_up = await self.pipeline.acomplete(question['question'], question['model'], prepared)
+            except Exception as e:
+                logger.warning(f"Question {question['id']} failed: {e}")
+                self._write(output, {**question, 'error': str(e)})
+                return
+        self._write(output, {**question, 'answer': answer, 'follow_up': follow_up,
+                             'cached': prepared[1] is not None, 'seconds': round(time.perf_counter() - start, 3)})
+
+    def _write(self, output, record):
+        # One line per result, flushed at once so that a crash loses at most the line being written.
+        output.write(json.dumps(record) + '\n')
+        output.flush()
+        if 'error' in record:
+            self.failed += 1
+        else:
+            self.answered += 1
@@ -1,11 +1,60 @@
+import itertools
+import os
 import re
+import string
 import unicodedata
+from multiprocessing import Pool
+
+CHAPTER_HEADING = re.compile(r'^\d+\s+Chapter\s+\d+\s+.*?\n', re.MULTILINE)
+SECTION_HEADING = re.compile(r'^Section\s+\d+(?:\.\d+)?\s+.*?\n', re.MULTILINE)
+CODE_BLOCK = re.compile(r'```.*?```', re.DOTALL)
+
+# Alphanumerics, common punctuation and newlines are kept; any other byte becomes a space.
+ALLOWED = (string.ascii_letters + string.digits + '.,;:(){}[]+-*/=<>%&|^$#@~\n').encode('ascii')
+WHITELIST = bytes(byte if byte in ALLOWED else ord(' ') for byte in range(256))
+
+# Below this many characters a process pool costs more to start and feed than it saves.
+PARALLEL_MIN_CHARS = int(os.getenv('CLEAN_PARALLEL_MIN_CHARS', 4_000_000))
+
+
+def clean_text(text):
+    # ASCII text is already NFKC-normalized.
+    if not text.isascii():
+        text = unicodedata.normalize('NFKC', text)
+    # The literal checks skip a regex scan over chapters that have nothing to remove.
+    if 'Chapter' in text:
+        text = CHAPTER_HEADING.sub('', text)
+    if 'Section' in text:
+        text = SECTION_HEADING.sub('', text)
+    if '```' in text:
+        text = CODE_BLOCK.sub('', text)
+    # Non-ASCII characters encode as '?', which the whitelist maps to a space like any
+    # other disallowed character; split/join then collapses whitespace and strips.
+    data = text.encode('ascii', 'replace').translate(WHITELIST)
+    return b' '.join(data.split()).decode('ascii')
+
+
+def _clean_chunk(texts):
+    return [clean_text(text) for text in texts]
+
+
+def _chunks(texts, chunk_chars):
+    chunk, size = [], 0
+    for text in texts:
+        chunk.append(text)
+        size += len(text)
+        if size >= chunk_chars:
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
 
 class DataPreprocessing:
     def __init__(self):
         pass
 
-
+    @staticmethod
     def clean_data(text):
         """
         Cleans textbook data for an AI chatbot by:
@@ -15,26 +64,39 @@ class DataPreprocessing:
         - Replacing unwanted characters while preserving key punctuation.
         - Normalizing whitespace.
         """
-        # Normalize Unicode (this can help in standardizing characters)
-        text = unicodedata.normalize('NFKC', text)
-
-        # Remove chapter headings (e.g., "1 Chapter 2 ..." at start of a line)
-        text = re.sub(r'^\d+\s+Chapter\s+\d+\s+.*?\n', '', text, flags=re.MULTILINE)
-
-        # Remove section headings (e.g., "Section 1.1 ..." at start of a line)
-        text = re.sub(r'^Section\s+\d+(?:\.\d+)?\s+.*?\n', '', text, flags=re.MULTILINE)
+        return clean_text(text)
 
-        # Remove code blocks enclosed in triple backticks
-        text = re.sub(r"```.*?```", "", text, flags=re.DOTALL)
+    clean_book_data = clean_data
+    clean_arvix = clean_data
 
-        # Replace any character not in the allowed set with a space.
-        # Allowed characters: alphanumerics, common punctuation, and newlines.
-        text = re.sub(r'[^A-Za-z0-9.,;:\(\)\{\}\[\]\+\-\*/=<>%&\|\^\$#@~\n]', ' ', text)
-
-        # Normalize whitespace (collapse multiple spaces/newlines into one space)
-        text = re.sub(r'\s+', ' ', text)
-
-        # Remove leading/trailing whitespace
-        text = text.strip()
+    @staticmethod
+    def clean_batch(texts, workers=None, min_chars=None, chunk_chars=1_000_000):
+        """
+        Clean many documents, in order. Cleaning runs in-process unless `workers`
+        (CLEAN_WORKERS, default 1) is above one and the documents add up to
+        `min_chars` (CLEAN_PARALLEL_MIN_CHARS, default 4M) characters; then they
+        go to the pool in tasks of about `chunk_chars` characters each.
+        """
+        workers = workers or int(os.getenv('CLEAN_WORKERS', 1))
+        min_chars = PARALLEL_MIN_CHARS if min_chars is None else min_chars
+        texts = iter(texts)
+        head, size = [], 0
+        if workers > 1:
+            # Read ahead only as far as it takes to tell a small batch from a large one.
+            for text in texts:
+                head.append(text)
+                size += len(text)
+                if size >= min_chars:
+                    break
+        if workers <= 1 or size < min_chars:
+            yield from map(clean_text, itertools.chain(head, texts))
+            return
+        with Pool(workers) as pool:
+            for cleaned in pool.imap(_clean_chunk, _chunks(itertools.chain(head, texts), chunk_chars)):
+                yield from cleaned
 
-        return text
+    @staticmethod
+    def clean_column(frame, column, workers=None):
+        """Return `frame[column]` cleaned, as a Series with the same index."""
+        import pandas as pd
+        return pd.Series(list(DataPreprocessing.clean_batch(frame[column], workers)), index=frame.index, name=column)
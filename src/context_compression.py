@@ -0,0 +1,87 @@
+import math
+import os
+import re
+import numpy as np
+from src.context_packing import split_sentences
+
+WORD = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has him his how its may new now old see two "
+    "who did get let say she too use what when where which while with this that these those from into about "
+    "explain describe tell does work works between there their then than them they have been were will would "
+    "could should".split())
+
+
+def _words(text):
+    return WORD.findall(text.lower())
+
+
+def _shingles(text, size=5):
+    words = _words(text)
+    return {' '.join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def dedupe_contexts(contexts, scores, embeddings=None, threshold=None, jaccard_threshold=0.8):
+    """
+    Drop near-duplicate contexts, keeping the best-scored copy. Two contexts
+    are duplicates when their embeddings (if known for both) have cosine
+    similarity of at least `threshold`, otherwise when their word 5-shingle
+    sets overlap by `jaccard_threshold` (Jaccard). Exact Jaccard is cheap for a
+    top-k this small, so there is no MinHash approximation.
+    """
+    threshold = threshold if threshold is not None else float(os.getenv('CONTEXT_DEDUP_THRESHOLD', 0.95))
+    embeddings = embeddings or {}
+    order = sorted(range(len(contexts)), key=lambda i: -scores[i])
+    kept = []
+    shingles = {}
+    for i in order:
+        text = contexts[i].page_content
+        duplicate = False
+        for j in kept:
+            other = contexts[j].page_content
+            if text in embeddings and other in embeddings:
+                duplicate = float(np.dot(embeddings[text], embeddings[other])) >= threshold
+            else:
+                a = shingles.setdefault(i, _shingles(text))
+                b = shingles.setdefault(j, _shingles(other))
+                duplicate = len(a & b) / len(a | b) >= jaccard_threshold
+            if duplicate:
+                break
+        if not duplicate:
+            kept.append(i)
+    kept.sort()
+    return [contexts[i] for i in kept], [scores[i] for i in kept]
+
+
+def compress_contexts(query, contexts, keep_ratio=None, min_sentences=2):
+    """
+    Extractive compression: in each context keep the sentences sharing the
+    most (rarity-weighted) terms with the query, in their original order: at
+    most about `keep_ratio` of them, and at least `min_sentences` even if they
+    share no term.
+    """
+    keep_ratio = keep_ratio if keep_ratio is not None else float(os.getenv('CONTEXT_KEEP_RATIO', 0.6))
+    if keep_ratio >= 1:
+        return contexts
+    terms = {word for word in _words(query) if len(word) > 2 and word not in STOPWORDS}
+    if not terms:
+        return contexts
+    split = [split_sentences(context.page_content) for context in contexts]
+    sentence_words = [[set(_words(sentence)) for sentence in sentences] for sentences in split]
+    n_sentences = sum(len(sentences) for sentences in split) or 1
+    # A query term found in every sentence says little about which ones to keep.
+    weights = {term: math.log(1 + n_sentences / (1 + sum(term in words for words_list in sentence_words
+                                                         for words in words_list)))
+               for term in terms}
+    compressed = []
+    for context, sentences, words_list in zip(contexts, split, sentence_words):
+        n_keep = max(min_sentences, math.ceil(keep_ratio * len(sentences)))
+        if len(sentences) <= n_keep:
+            compressed.append(context)
+            continue
+        relevance = [sum(weights[term] for term in terms & words) for words in words_list]
+        ranked = sorted(range(len(sentences)), key=lambda i: (-relevance[i], i))[:n_keep]
+        # Past the minimum, sentences without a single query term are not worth their tokens.
+        keep = sorted(ranked[:min_sentences] + [i for i in ranked[min_sentences:] if relevance[i] > 0])
+        compressed.append(type(context)(page_content=' '.join(sentences[i] for i in keep), metadata=context.metadata))
+    return compressed
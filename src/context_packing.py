@@ -0,0 +1,106 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+# Counts are keyed by a digest of the text, so the cache never keeps chunk texts alive.
+_counts = OrderedDict()
+_counts_lock = threading.Lock()
+_counter = None
+MAX_CACHED_COUNTS = 65536
+
+
+@lru_cache(maxsize=4)
+def get_tokenizer(name=None):
+    from transformers import AutoTokenizer
+    from src.load_models import EMBEDDING_MODEL_NAME
+    return AutoTokenizer.from_pretrained(name or os.getenv('PROMPT_TOKENIZER', EMBEDDING_MODEL_NAME))
+
+
+def _tokenizer_count(text):
+    return len(get_tokenizer().encode(text, add_special_tokens=False))
+
+
+def set_token_counter(count=None):
+    """Count tokens with `count(text)` instead of the tokenizer (None restores it); clears the cache."""
+    global _counter
+    with _counts_lock:
+        _counter = count
+        _counts.clear()
+
+
+def count_tokens(text):
+    # The same chunks come back for many queries, so their sentence counts are cached too.
+    key = hashlib.sha1(text.encode('utf-8')).digest()
+    with _counts_lock:
+        tokens = _counts.get(key)
+        if tokens is not None:
+            _counts.move_to_end(key)
+            return tokens
+        count = _counter or _tokenizer_count
+    tokens = count(text)
+    with _counts_lock:
+        _counts[key] = tokens
+        if len(_counts) > MAX_CACHED_COUNTS:
+            _counts.popitem(last=False)
+    return tokens
+
+
+def split_sentences(text):
+    return [sentence for sentence in SENTENCE_END.split(text.strip()) if sentence]
+
+
+def model_budget(env_name, default, model_idx=None):
+    """
+    Token budget for a model from `env_name`: one number for every model or a
+    comma-separated list indexed like the model selector.
+    """
+    budgets = [int(budget) for budget in os.getenv(env_name, str(default)).split(',')]
+    if model_idx is None or len(budgets) == 1:
+        return budgets[0]
+    return budgets[model_idx] if model_idx < len(budgets) else budgets[-1]
+
+
+def context_budget(model_idx=None):
+    return model_budget('CONTEXT_TOKEN_BUDGET', 1500, model_idx)
+
+
+def truncate_to_budget(text, budget, count=count_tokens):
+    """Return (text, tokens): the whole text if it fits, else its leading sentences that do."""
+    tokens = count(text)
+    if tokens <= budget:
+        return text, tokens
+    sentences, used = [], 0
+    for sentence in split_sentences(text):
+        tokens = count(sentence)
+        if used + tokens > budget:
+            break
+        sentences.append(sentence)
+        used += tokens
+    return ' '.join(sentences), used
+
+
+def pack_contexts(texts, budget, count=count_tokens):
+    """
+    Join retrieved texts, best first, as plain text within `budget` tokens. The
+    text that crosses the budget is cut at the last sentence that still fits,
+    and everything after it is dropped.
+    """
+    parts = []
+    used = 0
+    for i, text in enumerate(texts, start=1):
+        header = f"Context {i}:\n"
+        used += count(header)
+        if used >= budget:
+            break
+        packed, tokens = truncate_to_budget(text, budget - used, count)
+        if packed:
+            parts.append(header + packed)
+            used += tokens
+        if packed != text:
+            break
+    return '\n\n'.join(parts)
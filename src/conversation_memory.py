@@ -0,0 +1,80 @@
+import os
+from collections import deque
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+from src.context_packing import count_tokens, model_budget, truncate_to_budget
+
+SUMMARY_HEADER = "Earlier in this conversation:\n"
+
+
+def memory_budget(model_idx=None):
+    return model_budget('MEMORY_TOKEN_BUDGET', 600, model_idx)
+
+
+class ConversationMemory:
+    """
+    Chat history for one session. The last `window` turns are kept verbatim as
+    (question, answer) pairs; an older turn is folded into the summary as its
+    question and the lead of its answer, and the oldest summary lines are
+    dropped beyond `summary_tokens`. messages() renders both within a hard
+    token budget, newest turns first, so the prompt stays bounded however long
+    the session runs.
+    """
+
+    def __init__(self, window=None, summary_tokens=None, fold_tokens=60, count=count_tokens):
+        self.window = window or int(os.getenv('MEMORY_WINDOW', 4))
+        self.summary_tokens = summary_tokens or int(os.getenv('MEMORY_SUMMARY_TOKENS', 200))
+        self.fold_tokens = fold_tokens
+        self.count = count
+        self.turns = deque()
+        self.summary = deque()
+        self.summary_used = 0
+
+    def __len__(self):
+        return len(self.turns) + len(self.summary)
+
+    def add(self, question, answer):
+        self.turns.append((question, answer))
+        while len(self.turns) > self.window:
+            self._fold(*self.turns.popleft())
+
+    def clear(self):
+        self.turns.clear()
+        self.summary.clear()
+        self.summary_used = 0
+
+    def _fold(self, question, answer):
+        lead, _ = truncate_to_budget(answer, self.fold_tokens, self.count)
+        line = f"User asked: {question} Answer: {lead}" if lead else f"User asked: {question}"
+        self.summary.append((line, self.count(line)))
+        self.summary_used += self.summary[-1][1]
+        while self.summary_used > self.summary_tokens and len(self.summary) > 1:
+            self.summary_used -= self.summary.popleft()[1]
+
+    def messages(self, token_budget=None):
+        """Summary and recent turns as chat messages for the prompt's chat_history, within `token_budget`."""
+        budget = token_budget if token_budget is not None else memory_budget()
+        recent = []
+        for question, answer in reversed(self.turns):
+            used = self.count(question)
+            if used >= budget:
+                break
+            answer, tokens = truncate_to_budget(answer, budget - used, self.count)
+            if answer:
+                recent.append(AIMessage(content=answer))
+            recent.append(HumanMessage(content=question))
+            budget -= used + tokens
+            if not answer:
+                break
+        messages = []
+        # The summary gets what the verbatim turns leave, most recent lines first.
+        lines = []
+        budget -= self.count(SUMMARY_HEADER) if self.summary else 0
+        for line, tokens in reversed(self.summary):
+            if tokens > budget:
+                break
+            lines.append(line)
+            budget -= tokens
+        if lines:
+            messages.append(SystemMessage(content=SUMMARY_HEADER + '\n'.join(reversed(lines))))
+        messages.extend(reversed(recent))
+        return messages
@@ -0,0 +1,65 @@
+import hashlib
+
+
+def content_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingBatcher:
+    """
+    Embeds chunk records across chapter boundaries. Records are gathered into
+    windows of `window_size`, sorted by length so each fixed-size batch holds
+    similarly long texts (little padding), and yielded back as (record,
+    embedding). A text repeated within a window is embedded once and every
+    record carrying it is yielded with that embedding, so each chunk id still
+    reaches the index. With an EmbeddingStore, previously embedded texts
+    (including repeats from earlier windows) are read back instead.
+    """
+
+    def __init__(self, embedding_model, batch_size=64, window_size=4096, length_fn=None, store=None):
+        self.embedding_model = embedding_model
+        self.store = store
+        self.batch_size = batch_size
+        self.window_size = window_size
+        # Whitespace tokens track the tokenizer length closely enough for bucketing.
+        self.length_fn = length_fn or (lambda text: len(text.split()))
+        self.duplicates = 0
+
+    def embed_stream(self, records):
+        window = []
+        copies = {}
+        for record in records:
+            record['content_hash'] = content_hash(record['content'])
+            if record['content_hash'] in copies:
+                self.duplicates += 1
+                copies[record['content_hash']].append(record)
+                continue
+            copies[record['content_hash']] = []
+            window.append(record)
+            if len(window) >= self.window_size:
+                yield from self._with_copies(self._embed_window(window), copies)
+                window, copies = [], {}
+        if window:
+            yield from self._with_copies(self._embed_window(window), copies)
+
+    @staticmethod
+    def _with_copies(embedded, copies):
+        for record, embedding in embedded:
+            yield record, embedding
+            for copy in copies[record['content_hash']]:
+                yield copy, embedding
+
+    def _embed_window(self, window):
+        if self.store is not None:
+            cached = self.store.get_many([record['content_hash'] for record in window])
+            for record in window:
+                if record['content_hash'] in cached:
+                    yield record, cached[record['content_hash']].tolist()
+            window = [record for record in window if record['content_hash'] not in cached]
+        window.sort(key=lambda record: self.length_fn(record['content']))
+        for i in range(0, len(window), self.batch_size):
+            batch = window[i:i + self.batch_size]
+            embeddings = self.embedding_model.embed_documents([record['content'] for record in batch])
+            if self.store is not None:
+                self.store.put_many([record['content_hash'] for record in batch], embeddings)
+            yield from zip(batch, embeddings)
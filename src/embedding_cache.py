@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_query(text):
+    return " ".join(unicodedata.normalize('NFKC', text).casefold().split())
+
+
+class CachedEmbeddings:
+    """
+    Query-embedding cache in front of an embedding model: a bounded in-process
+    LRU backed by a SQLite file that survives restarts. Keys are the hash of the
+    model name and the normalized query. embed_documents is passed through.
+    """
+
+    def __init__(self, embedding_model, model_name, max_size=1024, cache_path=None):
+        self.embedding_model = embedding_model
+        self.model_name = model_name
+        self.max_size = max_size
+        self.cache_path = cache_path or os.path.join(os.getenv('CACHE_DIR', '.cache'), 'query_embeddings.sqlite')
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(self.cache_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self.db.commit()
+
+    def key(self, text):
+        return hashlib.sha1(f"{self.model_name}\0{normalize_query(text)}".encode('utf-8')).hexdigest()
+
+    def get(self, text):
+        key = self.key(text)
+        with self.lock:
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                self.hits += 1
+                return self.lru[key]
+            row = self.db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            embedding = np.frombuffer(row[0], dtype=np.float32).tolist()
+            self.disk_hits += 1
+            self._remember(key, embedding)
+            return embedding
+
+    def put(self, text, embedding):
+        key = self.key(text)
+        with self.lock:
+            self._remember(key, embedding)
+            self.db.execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                            (key, np.asarray(embedding, dtype=np.float32).tobytes()))
+            self.db.commit()
+
+    def _remember(self, key, embedding):
+        self.lru[key] = embedding
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.max_size:
+            self.lru.popitem(last=False)
+
+    def lookup(self, text):
+        """Return (embedding, cached): like embed_query, and whether the cache answered."""
+        embedding = self.get(text)
+        if embedding is not None:
+            return embedding, True
+        with self.lock:
+            self.misses += 1
+        embedding = self.embedding_model.embed_query(text)
+        self.put(text, embedding)
+        return embedding, False
+
+    async def alookup(self, text):
+        # The SQLite reads and writes run in a thread, off the event loop.
+        embedding = await asyncio.to_thread(self.get, text)
+        if embedding is not None:
+            return embedding, True
+        with self.lock:
+            self.misses += 1
+        embedding = await self.embedding_model.aembed_query(text)
+        await asyncio.to_thread(self.put, text, embedding)
+        return embedding, False
+
+    def lookup_many(self, texts):
+        """lookup() for many texts: the misses are embedded with one embed_documents call."""
+        embeddings = [self.get(text) for text in texts]
+        missing = {}
+        for text, embedding in zip(texts, embeddings):
+            if embedding is None:
+                missing.setdefault(self.key(text), text)
+        if missing:
+            with self.lock:
+                self.misses += len(missing)
+            computed = dict(zip(missing, self.embedding_model.embed_documents(list(missing.values()))))
+            self.put_many(list(missing.values()), list(computed.values()))
+        return [(embedding, True) if embedding is not None else (computed[self.key(text)], False)
+                for text, embedding in zip(texts, embeddings)]
+
+    def put_many(self, texts, embeddings):
+        keys = [self.key(text) for text in texts]
+        with self.lock:
+            for key, embedding in zip(keys, embeddings):
+                self._remember(key, embedding)
+            self.db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                [(key, np.asarray(embedding, dtype=np.float32).tobytes())
+                                 for key, embedding in zip(keys, embeddings)])
+            self.db.commit()
+
+    def embed_query(self, text):
+        return self.lookup(text)[0]
+
+    async def aembed_query(self, text):
+        return (await self.alookup(text))[0]
+
+    def embed_documents(self, texts):
+        return self.embedding_model.embed_documents(texts)
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'size': len(self.lru)}
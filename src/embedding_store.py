@@ -0,0 +1,146 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import numpy as np
+
+
+class EmbeddingStore:
+    """
+    Persistent document-embedding store: float32 rows appended to a flat file
+    that readers memory-map, and a SQLite table from (model name, content hash)
+    to row. Writers serialize on SQLite's write lock, so several processes can
+    read and append at once. compact() rewrites the file into a new generation;
+    readers pick the generation up on their next lookup.
+    """
+
+    def __init__(self, model_name, dimension=768, store_dir=None):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.row_bytes = 4 * dimension
+        self.store_dir = store_dir or os.getenv('EMBEDDING_STORE_DIR', os.path.join(os.getenv('CACHE_DIR', '.cache'), 'embeddings'))
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.store_dir, 'index.sqlite'), timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS rows (key TEXT PRIMARY KEY, model TEXT, row INTEGER)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        self.db.execute("INSERT OR IGNORE INTO meta VALUES ('generation', 0), ('n_rows', 0)")
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.generation = None
+        self.vectors = None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, content_hash):
+        return hashlib.sha1(f"{self.model_name}\0{content_hash}".encode('utf-8')).hexdigest()
+
+    def _path(self, generation):
+        return os.path.join(self.store_dir, f'vectors.{generation}.f32')
+
+    def _meta(self, name):
+        return self.db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()[0]
+
+    def _open(self, generation, n_rows):
+        # Re-map when another process appended rows or compacted into a new generation.
+        if generation != self.generation or self.vectors is None or len(self.vectors) < n_rows:
+            self.vectors = np.memmap(self._path(generation), dtype=np.float32, mode='r',
+                                     shape=(n_rows, self.dimension)) if n_rows else None
+            self.generation = generation
+
+    def get_many(self, content_hashes):
+        """Return {content_hash: embedding} for the hashes already stored."""
+        keys = {self.key(content_hash): content_hash for content_hash in content_hashes}
+        for attempt in range(2):
+            with self.lock:
+                # Rows and generation are read in one snapshot, so they always match.
+                self.db.execute("BEGIN")
+                try:
+                    generation, n_rows = self._meta('generation'), self._meta('n_rows')
+                    found = {}
+                    key_list = list(keys)
+                    for start in range(0, len(key_list), 500):
+                        chunk = key_list[start:start + 500]
+                        found.update(self.db.execute(
+                            f"SELECT key, row FROM rows WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+                finally:
+                    self.db.commit()
+                try:
+                    if found:
+                        self._open(generation, n_rows)
+                    embeddings = {keys[key]: np.array(self.vectors[row]) for key, row in found.items()}
+                    break
+                except FileNotFoundError:
+                    # A concurrent compaction removed this generation; look up again.
+                    if attempt:
+                        raise
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return embeddings
+
+    def put_many(self, content_hashes, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dimension)
+        with self.lock:
+            self._append(content_hashes, embeddings)
+
+    def _append(self, content_hashes, embeddings):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            generation, n_rows = self._meta('generation'), self._meta('n_rows')
+            path = self._path(generation)
+            with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                # Seek past committed rows only; bytes from an interrupted append get overwritten.
+                f.seek(n_rows * self.row_bytes)
+                f.write(embeddings.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.db.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?)",
+                                [(self.key(content_hash), self.model_name, n_rows + i)
+                                 for i, content_hash in enumerate(content_hashes)])
+            self.db.execute("UPDATE meta SET value = ? WHERE name = 'n_rows'", (n_rows + len(embeddings),))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def compact(self, keep_hashes=None):
+        """
+        Rewrite the store without orphaned rows. With keep_hashes, embeddings of
+        this model whose content hash is not listed are dropped as well.
+        """
+        with self.lock:
+            return self._compact(keep_hashes)
+
+    def _compact(self, keep_hashes):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            generation, n_rows = self._meta('generation'), self._meta('n_rows')
+            rows = self.db.execute("SELECT key, model, row FROM rows ORDER BY row").fetchall()
+            if keep_hashes is not None:
+                keep = {self.key(content_hash) for content_hash in keep_hashes}
+                rows = [(key, model, row) for key, model, row in rows if model != self.model_name or key in keep]
+            old = np.memmap(self._path(generation), dtype=np.float32, mode='r',
+                            shape=(n_rows, self.dimension)) if n_rows else None
+            new_generation = generation + 1
+            with open(self._path(new_generation), 'wb') as f:
+                for start in range(0, len(rows), 65536):
+                    f.write(np.asarray(old[[row for _, _, row in rows[start:start + 65536]]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.db.execute("DELETE FROM rows")
+            self.db.executemany("INSERT INTO rows VALUES (?, ?, ?)",
+                                [(key, model, i) for i, (key, model, _) in enumerate(rows)])
+            self.db.execute("UPDATE meta SET value = ? WHERE name = 'n_rows'", (len(rows),))
+            self.db.execute("UPDATE meta SET value = ? WHERE name = 'generation'", (new_generation,))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        del old
+        self.vectors = None
+        try:
+            # On POSIX, readers that still map the old file keep a valid view until they re-open.
+            os.remove(self._path(generation))
+        except OSError:
+            pass
+        return n_rows - len(rows)
@@ -1,11 +1,18 @@
+import logging
+import os
+import queue
 import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+logger = logging.getLogger(__name__)
+
+# A page that opens a chapter starts with e.g. "Chapter 3 Logic\n", "CHAPTER 3 ...\n" or "CHAPTER 3\n".
+CHAPTER_HEADING = re.compile(r'Chapter \d.+\n|CHAPTER \d.+\n|CHAPTER \d+\n')
 
 
 class ExtractData:
     def __init__(self):
-        self.chapter_no = 0
-        self.chapter_contents = ""
-        self.chapters = []
         self.dct_books = {
             "Artificial Intelligence: A Modern Approach, Global Edition, 4ed": range(19, 1073),
             'Designing Machine Learning Systems': range(1, 376),
@@ -13,40 +20,138 @@ class ExtractData:
             'dga.ps': range(1, 9)
         }
 
-    def extract(self, pdf_documents):
-        chapter_no = 0
-        chapter_contents = ""
-        chapters = []
+    def iter_pages(self, pdf_path):
+        """Yield (title, page_label, text) for the pages of a book's body, parsing only those pages."""
+        from pypdf import PdfReader
 
-        for doc in pdf_documents:
-            text = doc.page_content
+        reader = PdfReader(pdf_path)
+        title = reader.metadata.title if reader.metadata else None
+        pages = self.dct_books.get(title)
+        if pages is None:
+            logger.warning(f"Skipping {pdf_path}: no page range for title {title!r}")
+            return
+        for page, label in zip(reader.pages, reader.page_labels):
             try:
-                page_label = int(doc.metadata['page_label'])
-            except:
+                page_label = int(label)
+            except ValueError:
                 continue
-            if re.match(r'^Chapter \d.+\n', text) or re.match(r'^CHAPTER \d.+\n', text) or re.match(r'^CHAPTER \d+\n', text):
-                if page_label in self.dct_books[doc.metadata['title']]:
-                    if chapter_contents:
-                        chapter_no += 1
-                        chapters.append({
-                            "chapter_no": f'CHAPTER {chapter_no}',
-                            "content": chapter_contents,
-                            "title": doc.metadata['title'],
-                            "page_label": page_label
-                        })
-                    page_label = doc.metadata['page_label']
-                    chapter_contents = text
-            else:
+            # Front and back matter is skipped before its text is extracted.
+            if page_label in pages:
+                yield title, page_label, page.extract_text()
+
+    def extract_file(self, pdf_path):
+        """Stream the chapters of one PDF; only the current chapter is held in memory."""
+        return self._chapters(self.iter_pages(pdf_path))
+
+    def extract(self, pdf_documents):
+        """Chapters from already loaded langchain page Documents (e.g. from PyPDFLoader)."""
+        def pages():
+            for doc in pdf_documents:
+                try:
+                    page_label = int(doc.metadata['page_label'])
+                except (KeyError, ValueError):
+                    continue
                 if page_label in self.dct_books[doc.metadata['title']]:
-                    chapter_contents += text
+                    yield doc.metadata['title'], page_label, doc.page_content
+        return self._chapters(pages())
 
-        if page_label in self.dct_books[doc.metadata['title']]:
-            if chapter_contents:
+    def _chapters(self, pages):
+        for title, book_pages in groupby(pages, key=lambda page: page[0]):
+            chapter_no = 0
+            parts = []
+            start_page = None
+            for _, page_label, text in book_pages:
+                if CHAPTER_HEADING.match(text):
+                    if parts:
+                        chapter_no += 1
+                        yield self._chapter(title, chapter_no, parts, start_page)
+                    parts = []
+                    start_page = page_label
+                elif start_page is None:
+                    start_page = page_label
+                parts.append(text)
+            if parts:
                 chapter_no += 1
-                chapters.append({
-                    "chapter_no": f'CHAPTER {chapter_no}',
-                    "content": chapter_contents,
-                    "title": doc.metadata['title'],
-                    "page_label": doc.metadata['page_label']
-                })
-        return self.chapters
+                yield self._chapter(title, chapter_no, parts, start_page)
+
+    def _chapter(self, title, chapter_no, parts, start_page):
+        return {
+            "chapter_no": f'CHAPTER {chapter_no}',
+            "content": "".join(parts),
+            "title": title,
+            "chapter_page_no": start_page
+        }
+
+
+_chapter_queues = None
+_stop = None
+
+
+def _init_extract_worker(chapter_queues, stop):
+    global _chapter_queues, _stop
+    _chapter_queues, _stop = chapter_queues, stop
+
+
+def _put(file_no, chapter):
+    # Waits for the reader to reach this file, unless it has stopped reading.
+    while not _stop.is_set():
+        try:
+            _chapter_queues[file_no].put(chapter, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _extract_to_queue(file_no, pdf_path):
+    try:
+        for chapter in ExtractData().extract_file(pdf_path):
+            if not _put(file_no, chapter):
+                return
+    finally:
+        # End-of-file marker; it follows this file's chapters through the same queue.
+        _put(file_no, None)
+
+
+def iter_chapters(pdf_paths, workers=None, queue_size=None):
+    """
+    Chapters of all `pdf_paths` in file order, each book's in page order. Up to
+    `workers` PDFs are parsed at once by worker processes; every file streams
+    its chapters through its own bounded queue, which is read once the files
+    before it are done, so memory holds a few chapters per worker rather than
+    whole books and the order never depends on worker timing.
+    """
+    import multiprocessing
+
+    pdf_paths = list(pdf_paths)
+    workers = min(workers or os.cpu_count() or 1, len(pdf_paths))
+    if workers <= 1:
+        for pdf_path in pdf_paths:
+            yield from ExtractData().extract_file(pdf_path)
+        return
+    context = multiprocessing.get_context()
+    chapter_queues = [context.Queue(maxsize=queue_size or 2) for _ in pdf_paths]
+    stop = context.Event()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_extract_worker,
+                             initargs=(chapter_queues, stop)) as executor:
+        # Files start in order, so the one being read is always running or finished.
+        futures = [executor.submit(_extract_to_queue, file_no, pdf_path) for file_no, pdf_path in enumerate(pdf_paths)]
+        try:
+            for file_no, chapter_queue in enumerate(chapter_queues):
+                while True:
+                    try:
+                        chapter = chapter_queue.get(timeout=1)
+                    except queue.Empty:
+                        # A worker that died never sends its end-of-file marker.
+                        for future in futures:
+                            if future.done() and future.exception() is not None:
+                                raise future.exception()
+                        continue
+                    if chapter is None:
+                        futures[file_no].result()  # re-raise a parsing error
+                        break
+                    yield chapter
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
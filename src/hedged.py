@@ -0,0 +1,146 @@
+import asyncio
+import os
+import time
+from collections import defaultdict, deque
+
+
+class LatencyTracker:
+    """
+    Sliding window of recent latencies per (provider, kind), kind being 'total'
+    or 'first_token'. A censored sample is a call cancelled after `seconds`:
+    its latency is only known to be longer. Percentiles use the Kaplan-Meier
+    estimate, so losing hedged calls push the tail up instead of vanishing.
+    """
+
+    def __init__(self, window=200):
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, provider, seconds, kind='total', censored=False):
+        self.samples[(provider, kind)].append((seconds, censored))
+
+    def percentile(self, provider, q, kind='total'):
+        samples = sorted(self.samples[(provider, kind)])
+        if not samples:
+            return None
+        survival = 1.0
+        for at_risk, (seconds, censored) in zip(range(len(samples), 0, -1), samples):
+            if not censored:
+                survival *= 1 - 1 / at_risk
+                if 1 - survival >= q:
+                    return seconds
+        # The quantile lies beyond every observation; the longest one is a lower bound.
+        return samples[-1][0]
+
+    def count(self, provider, kind='total'):
+        return len(self.samples[(provider, kind)])
+
+
+class HedgedGenerator:
+    """
+    Send a request to a primary provider and, if it has not answered after the
+    hedge delay, also to a secondary one; the first to finish wins and the other
+    is cancelled. Once a provider has `min_samples` latencies, its hedge delay
+    adapts to the `quantile` of them, so only the slow tail gets hedged. Until
+    then a whole answer is hedged after `hedge_delay` and a stream after
+    `first_token_delay`.
+    """
+
+    def __init__(self, hedge_delay=None, first_token_delay=None, quantile=0.95, min_samples=20, tracker=None):
+        self.hedge_delay = hedge_delay if hedge_delay is not None else float(os.getenv('HEDGE_DELAY', 10.0))
+        self.first_token_delay = (first_token_delay if first_token_delay is not None
+                                  else float(os.getenv('HEDGE_FIRST_TOKEN_DELAY', 2.0)))
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.tracker = tracker or LatencyTracker()
+
+    def delay_for(self, provider, kind='total'):
+        if self.tracker.count(provider, kind) >= self.min_samples:
+            return self.tracker.percentile(provider, self.quantile, kind)
+        return self.hedge_delay if kind == 'total' else self.first_token_delay
+
+    async def _timed(self, provider, call):
+        start = time.perf_counter()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            self.tracker.record(provider, time.perf_counter() - start, censored=True)
+            raise
+        self.tracker.record(provider, time.perf_counter() - start)
+        return provider, result
+
+    async def generate(self, calls, primary, secondary):
+        """
+        calls maps a provider index to a zero-argument coroutine function.
+        Returns (winning provider, result).
+        """
+        tasks = {asyncio.ensure_future(self._timed(primary, calls[primary]))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.delay_for(primary))
+            primary_failed = bool(done) and next(iter(done)).exception() is not None
+            if secondary is not None and (not done or primary_failed):
+                tasks.add(asyncio.ensure_future(self._timed(secondary, calls[secondary])))
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                if not tasks:
+                    # Every provider failed; surface the last error.
+                    return done.pop().result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def stream(self, streams, primary, secondary, on_winner=None):
+        """
+        Hedged streaming: streams maps a provider index to a function returning an
+        async iterator of chunks. The first provider to produce a chunk wins and
+        the rest of its stream is forwarded; the losing stream is closed.
+        on_winner, if given, is called with the winning provider.
+        """
+        iterators = {}
+        pending = {}
+
+        def start(provider):
+            iterators[provider] = streams[provider]().__aiter__()
+            started = time.perf_counter()
+
+            async def first_chunk():
+                try:
+                    chunk = await iterators[provider].__anext__()
+                except asyncio.CancelledError:
+                    self.tracker.record(provider, time.perf_counter() - started, 'first_token', censored=True)
+                    raise
+                self.tracker.record(provider, time.perf_counter() - started, 'first_token')
+                return chunk
+            pending[asyncio.ensure_future(first_chunk())] = provider
+
+        start(primary)
+        winner = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.delay_for(primary, 'first_token'))
+            primary_failed = bool(done) and next(iter(done)).exception() is not None
+            if secondary is not None and (not done or primary_failed):
+                start(secondary)
+            while winner is None:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None and winner is None:
+                        winner, first = provider, task.result()
+                if winner is None and not pending:
+                    # Every provider failed before its first chunk; surface the last error.
+                    task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for provider, iterator in iterators.items():
+                if provider != winner and hasattr(iterator, 'aclose'):
+                    await iterator.aclose()
+
+        if on_winner is not None:
+            on_winner(winner)
+        yield first
+        async for chunk in iterators[winner]:
+            yield chunk
@@ -0,0 +1,184 @@
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from src.chunking import Chunking
+from src.clean_data import DataPreprocessing
+from src.embedding_batcher import EmbeddingBatcher
+from src.embedding_store import EmbeddingStore
+from src.extract_data import iter_chapters
+from src.load_models import EMBEDDING_MODEL_NAME
+from src.manifest import IndexManifest, UpsertCheckpoint, chunk_id
+from src.upsert_writer import UpsertWriter
+from src.vector_store import mark_index_updated
+
+logger = logging.getLogger(__name__)
+
+_worker = {}
+
+
+def _init_worker():
+    # spaCy and the tokenizer are loaded once per worker process, not per PDF.
+    _worker['chunking'] = Chunking()
+
+
+def process_chapter(chapter):
+    """Clean and chunk one chapter. Runs in a worker process."""
+    content = DataPreprocessing.clean_data(chapter['content'])
+    return [{'title': chapter['title'], 'chapter_no': chapter['chapter_no'],
+             'chapter_page_no': chapter['chapter_page_no'], 'position': position, 'content': chunk}
+            for position, chunk in enumerate(_worker['chunking'].dynamic_chunking(content))]
+
+
+class IngestionEngine:
+    """
+    Staged ingestion: one set of worker processes parses a PDF each and streams
+    its chapters back as they complete, a second process pool cleans and chunks
+    one chapter per task, and two threads joined by bounded queues embed and
+    upsert concurrently. Embedding goes through an EmbeddingBatcher, so
+    batches span chapters and duplicate chunks are embedded once. Chapters
+    arrive in pdf_paths order and chunk results are consumed in submission
+    order, so a run's output does not depend on worker timing. Chapters whose
+    content is unchanged since the last run (per the IndexManifest) are
+    skipped, and vectors of removed or changed chapters are deleted. With a
+    durable store, an UpsertCheckpoint lets a rerun after a crash skip the
+    chunks that were already upserted.
+    """
+
+    def __init__(self, embedding_model, store, workers=None, queue_size=8,
+                 embed_batch_size=64, upsert_batch_size=100, writers=4):
+        self.embedding_model = embedding_model
+        self.store = store
+        self.workers = workers or int(os.getenv('INGEST_WORKERS', os.cpu_count() or 1))
+        self.queue_size = queue_size
+        self.upsert_batch_size = upsert_batch_size
+        self.writers = writers
+        self.embedding_store = EmbeddingStore(getattr(embedding_model, 'model_name', EMBEDDING_MODEL_NAME))
+        self.batcher = EmbeddingBatcher(embedding_model, batch_size=embed_batch_size, store=self.embedding_store)
+        self.stats = {'pdfs': 0, 'unchanged_chapters': 0, 'chunks': 0, 'duplicates': 0, 'upserted': 0,
+                      'resumed_chunks': 0}
+        # Local stores only persist on flush, so their acks are not durable and are not checkpointed.
+        self.checkpoint = None
+        if getattr(store, 'durable', True):
+            self.checkpoint = UpsertCheckpoint(getattr(store, 'index_name', 'ai-chatbot'))
+
+    def _embed_stage(self, chunk_queue, vector_queue, errors):
+        finished = False
+
+        def records():
+            nonlocal finished
+            while True:
+                chapter_records = chunk_queue.get()
+                if chapter_records is None:
+                    finished = True
+                    return
+                yield from chapter_records
+
+        try:
+            vectors = []
+            for record, embedding in self.batcher.embed_stream(records()):
+                vectors.append({'id': record['id'], 'values': embedding,
+                                'metadata': {'title': record['title'], 'chapter_page_no': record['chapter_page_no'],
+                                             'content': record['content']}})
+                if len(vectors) == self.upsert_batch_size:
+                    vector_queue.put(vectors)
+                    vectors = []
+            if vectors:
+                vector_queue.put(vectors)
+            self.stats['duplicates'] = self.batcher.duplicates
+            self.stats['cached_embeddings'] = self.embedding_store.hits
+        except Exception as e:
+            errors.append(e)
+            # Keep draining so the producer never blocks on a full queue.
+            while not finished and chunk_queue.get() is not None:
+                pass
+        finally:
+            vector_queue.put(None)
+
+    def _upsert_stage(self, vector_queue, errors):
+        on_done = self.checkpoint.add if self.checkpoint is not None else None
+        writer = UpsertWriter(self.store, writers=self.writers, on_done=on_done)
+        try:
+            while True:
+                vectors = vector_queue.get()
+                if vectors is None:
+                    break
+                writer.submit(vectors, tag=[vector['id'] for vector in vectors])
+        except Exception as e:
+            errors.append(e)
+            # Keep draining so the embedder never blocks on a full queue either.
+            while vector_queue.get() is not None:
+                pass
+        finally:
+            try:
+                self.stats['upserted'] = writer.close()
+            except Exception as e:
+                errors.append(e)
+
+    def run(self, pdf_paths):
+        chunk_queue = queue.Queue(maxsize=self.queue_size)
+        vector_queue = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        embedder = threading.Thread(target=self._embed_stage, args=(chunk_queue, vector_queue, errors))
+        upserter = threading.Thread(target=self._upsert_stage, args=(vector_queue, errors))
+        embedder.start()
+        upserter.start()
+        manifest = IndexManifest(getattr(self.store, 'index_name', 'ai-chatbot'))
+        done_ids = self.checkpoint.done if self.checkpoint is not None else set()
+        if done_ids:
+            logger.info(f"Resuming after {len(done_ids)} upserted chunks")
+
+        def emit(chapter, records):
+            for record in records:
+                record['id'] = chunk_id(record['title'], record['chapter_no'], record['content'])
+            # The manifest lists every chunk, including those a crashed run already upserted.
+            manifest.record(chapter, [record['id'] for record in records])
+            self.stats['chunks'] += len(records)
+            pending = [record for record in records if record['id'] not in done_ids]
+            self.stats['resumed_chunks'] += len(records) - len(pending)
+            chunk_queue.put(pending)
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker) as executor:
+                in_flight = deque()
+                chapters = iter_chapters(pdf_paths, workers=self.workers)
+                try:
+                    for chapter in chapters:
+                        if errors:
+                            break
+                        if manifest.is_current(chapter):
+                            self.stats['unchanged_chapters'] += 1
+                            continue
+                        in_flight.append((chapter, executor.submit(process_chapter, chapter)))
+                        # Bound the chapters held in memory; the oldest result is emitted first.
+                        if len(in_flight) >= 2 * self.workers:
+                            chapter, future = in_flight.popleft()
+                            emit(chapter, future.result())
+                    else:
+                        self.stats['pdfs'] = len(pdf_paths)
+                finally:
+                    chapters.close()
+                while in_flight and not errors:
+                    chapter, future = in_flight.popleft()
+                    emit(chapter, future.result())
+                for _, future in in_flight:
+                    future.cancel()
+        finally:
+            chunk_queue.put(None)
+            embedder.join()
+            upserter.join()
+        if errors:
+            raise errors[0]
+        stale = manifest.stale_ids()
+        if stale:
+            self.store.delete(stale)
+        self.stats['deleted'] = len(stale)
+        self.store.flush()
+        manifest.save()
+        if self.checkpoint is not None:
+            self.checkpoint.clear()
+        mark_index_updated()
+        return self.stats
+
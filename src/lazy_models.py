@@ -0,0 +1,66 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class LazyModels:
+    """
+    Sequence of models built on first access. Each entry has its own lock, so
+    two sessions selecting the same model build it once, and selecting one
+    model never waits for another to be built.
+    """
+
+    def __init__(self, factories):
+        self.factories = list(factories)
+        self.models = [None] * len(self.factories)
+        self.locks = [threading.Lock() for _ in self.factories]
+        self.build_seconds = {}
+
+    def __len__(self):
+        return len(self.factories)
+
+    def __getitem__(self, idx):
+        model = self.models[idx]
+        if model is not None:
+            return model
+        with self.locks[idx]:
+            if self.models[idx] is None:
+                start = time.perf_counter()
+                self.models[idx] = self.factories[idx]()
+                self.build_seconds[idx] = time.perf_counter() - start
+            return self.models[idx]
+
+    def __iter__(self):
+        return (self[idx] for idx in range(len(self)))
+
+    def is_loaded(self, idx):
+        return self.models[idx] is not None
+
+
+class BackgroundModel:
+    """
+    Loads a model on a daemon thread as soon as it is created; get() blocks
+    until it is ready and re-raises a loading error in the caller.
+    """
+
+    def __init__(self, factory, name="model-loader"):
+        self.future = Future()
+        self.started = time.perf_counter()
+        self.load_seconds = None
+        self.thread = threading.Thread(target=self._load, args=(factory,), name=name, daemon=True)
+        self.thread.start()
+
+    def _load(self, factory):
+        try:
+            model = factory()
+        except BaseException as e:
+            self.future.set_exception(e)
+        else:
+            self.load_seconds = time.perf_counter() - self.started
+            self.future.set_result(model)
+
+    def ready(self):
+        return self.future.done()
+
+    def get(self, timeout=None):
+        return self.future.result(timeout)
@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 import logging
 from datasets import load_dataset
@@ -6,10 +7,15 @@ from langchain_community.document_loaders import PyPDFDirectoryLoader
 
 class DataIngestion:
     def __init__(self):
-        pass
+        self.pdf_folder = os.getenv('PDF_FOLDER', r"D:\BroCamp\Projects\Chatbot-ai\Data")
+
+    def list_pdfs(self):
+        # Sorted so every run ingests the books in the same order.
+        return sorted(os.path.join(self.pdf_folder, name) for name in os.listdir(self.pdf_folder)
+                      if name.lower().endswith('.pdf'))
 
     def load_data(self):
-        pdf_folder = "D:\BroCamp\Projects\Chatbot-ai\Data"
+        pdf_folder = self.pdf_folder
         try:
             pdf_loader = PyPDFDirectoryLoader(pdf_folder)
             pdf_documents = pdf_loader.load()
@@ -1,71 +1,98 @@
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_mistralai import ChatMistralAI
-from langchain_together import Together
+import logging
 from dotenv import load_dotenv
-import torch
 import os
 
+logger = logging.getLogger(__name__)
+
+
+EMBEDDING_MODEL_NAME = 'sentence-transformers/all-mpnet-base-v2'
+
 
 class CreateModels:
+    """
+    Model factories. torch, transformers and the provider SDKs are imported
+    inside each create method, and each method checks only its own API key, so
+    a missing key or a slow import costs nothing until that model is used.
+    """
+
     def __init__(self):
         load_dotenv()
 
-        self.hf_token = os.getenv('HF_TOKEN')
-        if self.hf_token is None:
-            raise ValueError("HF_TOKEN is not set in the environment.")
-        self.gemini_key = os.getenv('GOOGLE_API_KEY')
-        if self.gemini_key is None:
-            raise ValueError("Gemini token is not set in the environment.")
-        self.mistral_key = os.getenv('MISTRAL_API_KEY')
-        if self.mistral_key is None:
-            raise ValueError("MISTRAL token is not set in the environment.")
-        self.together_key = os.getenv('TOGHTHER_API_KEY')
-        if self.together_key is None:
-            raise ValueError("TOGETHER token is not set in the environment.")
+    def _key(self, name, label):
+        key = os.getenv(name)
+        if key is None:
+            raise ValueError(f"{label} token is not set in the environment.")
+        return key
 
     def create_embedding(self):
+        backend = os.getenv('EMBEDDING_BACKEND', 'torch').lower()
+        if backend == 'onnx':
+            return self.create_onnx_embedding()
+        if backend != 'torch':
+            raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
+        return self.create_torch_embedding()
+
+    def create_torch_embedding(self):
+        import torch
+        from langchain_huggingface import HuggingFaceEmbeddings
 
+        self._key('HF_TOKEN', "HF")
+        threads = int(os.getenv('EMBEDDING_THREADS', 0))
+        if threads:
+            torch.set_num_threads(threads)
         if torch.cuda.is_available():
             model_kwargs = {'device': 'cuda'}
-            print("Using GPU")
+            logger.info("Using GPU")
         else:
             model_kwargs = {'device': 'cpu'}
-            print("Using CPU")
+            logger.info("Using CPU")
         encode_kwargs = {'normalize_embeddings': True}
-        model_name = 'sentence-transformers/all-mpnet-base-v2'
-        embedding_model = HuggingFaceEmbeddings(model_name=model_name,
+        embedding_model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME,
                                                 model_kwargs=model_kwargs,
                                                 encode_kwargs=encode_kwargs
                                                 )
         return embedding_model
 
+    def create_onnx_embedding(self):
+        from src.onnx_embeddings import OnnxEmbeddings
+
+        self._key('HF_TOKEN', "HF")
+        logger.info("Using ONNX Runtime on CPU")
+        return OnnxEmbeddings(EMBEDDING_MODEL_NAME, quantize=os.getenv('ONNX_QUANTIZE', '1') == '1')
+
     def create_gemini(self):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
         gemini_model = ChatGoogleGenerativeAI(
-            api_key=self.gemini_key,
+            api_key=self._key('GOOGLE_API_KEY', "Gemini"),
             model="gemini-1.5-pro",
             temperature=0.4,
             max_tokens=8912,
             timeout=None,
-            max_retries=2,
+            # Retried by the provider gateway, within its shared retry budget.
+            max_retries=0,
         )
         return gemini_model
 
     def create_deepseek(self):
+        from langchain_mistralai import ChatMistralAI
+
         # falcon_repo = "mistralai/Mistral-8X22B-Instruct-v0.3"
         mistral_model = ChatMistralAI(
-            api_key=self.mistral_key,
+            api_key=self._key('MISTRAL_API_KEY', "MISTRAL"),
             model="mistral-large-latest",
             temperature=0,
-            max_retries=2,
+            max_retries=0,
         )
         return mistral_model
 
     def create_llama(self):
+        from langchain_together import Together
+
         # Initialize the Together AI LLM with Llama 3
         llama_model = Together(
             model="meta-llama/Llama-3.3-70B-Instruct-Turbo-Free",
-            together_api_key=self.together_key,
+            together_api_key=self._key('TOGHTHER_API_KEY', "TOGETHER"),
             max_tokens=2048,
             temperature=0.7
         )
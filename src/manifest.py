@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+
+
+def chunk_id(title, chapter_no, text):
+    # Same book, chapter and text always map to the same vector id, so re-upserts overwrite.
+    return hashlib.sha1(f"{title}\0{chapter_no}\0{text}".encode('utf-8')).hexdigest()
+
+
+def chapter_key(chapter):
+    return f"{chapter['title']}/{chapter['chapter_no']}"
+
+
+def chapter_hash(chapter):
+    return hashlib.sha1(chapter['content'].encode('utf-8')).hexdigest()
+
+
+class IndexManifest:
+    """
+    Record of what is in the index: for every chapter, the hash of its content
+    and the ids of the vectors it produced. It is saved only after a successful
+    run, so an interrupted run simply redoes (idempotently) the same chapters.
+    """
+
+    def __init__(self, index_name="ai-chatbot", path=None):
+        self.path = path or os.path.join(os.getenv('LOCAL_INDEX_DIR', 'vector_index'), f'{index_name}_manifest.json')
+        self.chapters = {}
+        self.updates = {}
+        self.seen = set()
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                self.chapters = json.load(f)
+
+    def is_current(self, chapter):
+        """Mark the chapter as present in this run and tell whether it can be skipped."""
+        key = chapter_key(chapter)
+        self.seen.add(key)
+        entry = self.chapters.get(key)
+        return entry is not None and entry['hash'] == chapter_hash(chapter)
+
+    def record(self, chapter, ids):
+        self.updates[chapter_key(chapter)] = {'hash': chapter_hash(chapter), 'ids': list(ids)}
+
+    def stale_ids(self):
+        """Ids of vectors from chapters that disappeared or whose chunks changed."""
+        stale = []
+        for key, entry in self.chapters.items():
+            if key not in self.seen:
+                stale.extend(entry['ids'])
+            elif key in self.updates:
+                current = set(self.updates[key]['ids'])
+                stale.extend(chunk for chunk in entry['ids'] if chunk not in current)
+        return stale
+
+    def save(self):
+        chapters = {key: entry for key, entry in self.chapters.items() if key in self.seen}
+        chapters.update(self.updates)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(chapters, f)
+        os.replace(self.path + '.tmp', self.path)
+        self.chapters = chapters
+        self.updates = {}
+
+
+class UpsertCheckpoint:
+    """
+    Append-only list of the ids of chunks whose vectors a durable store has
+    acked. A run that crashed before saving the manifest redoes its chapters,
+    and chunks listed here are not embedded or upserted again. Ids are content
+    hashes, so batches may be acked in any order. Removed once the run completes.
+    """
+
+    def __init__(self, index_name="ai-chatbot", path=None):
+        self.path = path or os.path.join(os.getenv('CACHE_DIR', '.cache'), f'{index_name}_upsert_checkpoint.txt')
+        self.done = set()
+        if os.path.exists(self.path):
+            # A line cut off by a crash is not a whole id and matches nothing.
+            with open(self.path, encoding='utf-8') as f:
+                self.done = {line.strip() for line in f if line.strip()}
+
+    def add(self, ids):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(chunk + '\n' for chunk in ids)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.done = set()
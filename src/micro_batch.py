@@ -0,0 +1,105 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatchEmbedder:
+    """
+    Shared query-embedding service. Concurrent embed_query calls are queued;
+    a single worker thread takes the first pending query, waits at most
+    `max_wait` seconds for up to `max_batch` more, embeds them in one
+    embed_documents call and resolves each caller's future. An idle caller
+    pays at most `max_wait` extra latency; under load, batches fill up before
+    the deadline and cores run one forward pass instead of many.
+    """
+
+    def __init__(self, embedding_model, max_batch=None, max_wait=None):
+        self.embedding_model = embedding_model
+        self.max_batch = max_batch or int(os.getenv('EMBED_MAX_BATCH', 32))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv('EMBED_MAX_WAIT_MS', 5)) / 1000
+        self.model_name = getattr(embedding_model, 'model_name', None)
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.embedded = 0
+        self.worker = threading.Thread(target=self._run, name="micro-batch-embedder", daemon=True)
+        self.worker.start()
+
+    def submit(self, text):
+        future = Future()
+        self.requests.put((text, future))
+        return future
+
+    def embed_query(self, text):
+        return self.submit(text).result()
+
+    async def aembed_query(self, text):
+        return await asyncio.wrap_future(self.submit(text))
+
+    def embed_documents(self, texts):
+        # Document batches are already large; they go straight to the model.
+        return self.embedding_model.embed_documents(texts)
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [(text, future) for text, future in self._collect() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                embeddings = self.embedding_model.embed_documents([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.embedded += len(batch)
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    @property
+    def stats(self):
+        return {'batches': self.batches, 'embedded': self.embedded,
+                'mean_batch_size': self.embedded / self.batches if self.batches else 0.0}
+
+
+def benchmark_micro_batching(embedding_model, texts, concurrency=(1, 4, 16, 64), max_batch=32, max_wait=0.005):
+    """
+    Queries/s and p50/p95 latency for `concurrency` client threads embedding
+    `texts`, each query run alone (direct) or through a MicroBatchEmbedder.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+
+    def timed(model, text):
+        start = time.perf_counter()
+        model.embed_query(text)
+        return time.perf_counter() - start
+
+    results = []
+    batcher = MicroBatchEmbedder(embedding_model, max_batch=max_batch, max_wait=max_wait)
+    for clients in concurrency:
+        for name, model in (('direct', embedding_model), ('micro_batch', batcher)):
+            with ThreadPoolExecutor(clients) as pool:
+                start = time.perf_counter()
+                latencies = list(pool.map(lambda text: timed(model, text), texts))
+                elapsed = time.perf_counter() - start
+            results.append({'mode': name, 'clients': clients, 'queries_per_s': len(texts) / elapsed,
+                            'p50_ms': float(np.percentile(latencies, 50) * 1000),
+                            'p95_ms': float(np.percentile(latencies, 95) * 1000)})
+    results.append({'mode': 'micro_batch', **batcher.stats})
+    return results
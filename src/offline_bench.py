@@ -0,0 +1,348 @@
+import asyncio
+import contextlib
+import os
+import random
+import re
+import resource
+import tempfile
+import threading
+import time
+import zlib
+from functools import lru_cache
+import numpy as np
+from src.ann_index import _normalize, exact_search, exact_search_many
+
+TOPICS = {
+    'neural networks': "neuron layer activation weight backpropagation gradient perceptron hidden sigmoid relu",
+    'decision trees': "split node leaf entropy gini impurity pruning depth branch forest",
+    'reinforcement learning': "agent reward policy state action environment value bellman exploration episode",
+    'probability': "bayes prior posterior likelihood distribution random variable expectation variance conditional",
+    'search': "heuristic frontier node path cost admissible breadth depth graph goal",
+    'optimization': "loss gradient descent learning rate momentum convergence minimum convex step batch",
+    'language models': "token embedding attention transformer sequence vocabulary context decoder encoder prompt",
+    'deployment': "latency throughput monitoring drift serving feature store pipeline batch online",
+}
+FILLER = "the a of to and is in that it for as with on by this be are from or an can which".split()
+
+
+def synthetic_corpus(n_chapters=200, chapter_words=3000, seed=0):
+    """
+    Book-like chapters, each about one topic: topic vocabulary mixed with
+    filler words, grouped into sentences. Deterministic for a given seed.
+    """
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    chapters = []
+    for chapter_no in range(n_chapters):
+        topic = topics[chapter_no % len(topics)]
+        vocabulary = TOPICS[topic].split()
+        words = [rng.choice(vocabulary) if rng.random() < 0.4 else rng.choice(FILLER) for _ in range(chapter_words)]
+        sentences = [' '.join(words[i:i + 18]).capitalize() + '.' for i in range(0, len(words), 18)]
+        chapters.append({'title': f'Synthetic Book {chapter_no // 20}', 'chapter_no': f'CHAPTER {chapter_no % 20 + 1}',
+                         'chapter_page_no': chapter_no * 20 + 1, 'content': '\n'.join(sentences)})
+    return chapters
+
+
+def synthetic_queries(n_queries=200, seed=1):
+    rng = random.Random(seed)
+    queries = []
+    for i in range(n_queries):
+        topic = rng.choice(list(TOPICS))
+        terms = rng.sample(TOPICS[topic].split(), 3)
+        queries.append(f"({i}) How does {terms[0]} relate to {terms[1]} and {terms[2]} in {topic}?")
+    return queries
+
+
+def simple_chunks(text, max_token=256):
+    """Sentence-packing chunker without spaCy; whitespace tokens approximate the tokenizer."""
+    chunks, current, length = [], [], 0
+    for sentence in re.split(r'(?<=[.!?])\s+', text):
+        n_tokens = len(sentence.split())
+        if current and length + n_tokens > max_token:
+            chunks.append(' '.join(current))
+            current, length = [], 0
+        current.append(sentence)
+        length += n_tokens
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+@lru_cache(maxsize=65536)
+def _token_vector(token, dimension):
+    return np.random.default_rng(zlib.crc32(token.encode('utf-8'))).standard_normal(dimension).astype(np.float32)
+
+
+class FakeEmbeddings:
+    """
+    Deterministic embedding model: the normalized sum of a fixed random vector
+    per lowercased token, so texts sharing words land close together. Optional
+    sleeps stand in for model cost per call and per text.
+    """
+
+    model_name = 'fake-hashed-bag-of-words'
+
+    def __init__(self, dimension=768, latency=0.0, latency_per_text=0.0):
+        self.dimension = dimension
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in re.findall(r'\w+', text.lower()):
+            vector += _token_vector(token, self.dimension)
+        return _normalize(vector)
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        time.sleep(self.latency + self.latency_per_text * len(texts))
+        return [self._embed(text).tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text):
+        return await asyncio.to_thread(self.embed_query, text)
+
+
+class FakeChatModel:
+    """
+    Chat model stand-in with a fixed time to first token and token rate. The
+    answer is derived from the prompt (so it is deterministic) and ends with
+    the follow-up block the response parser expects. Like Together, it yields
+    plain strings.
+    """
+
+    def __init__(self, latency=0.05, tokens_per_s=2000, answer_tokens=120):
+        self.latency = latency
+        self.tokens_per_s = tokens_per_s
+        self.answer_tokens = answer_tokens
+
+    def _tokens(self, prompt):
+        rng = random.Random(zlib.crc32(str(prompt).encode('utf-8')))
+        words = ' '.join(TOPICS.values()).split() + FILLER
+        tokens = [rng.choice(words) + ' ' for _ in range(self.answer_tokens)]
+        return tokens + ["\n\nFollow up questions: ", "1. What is a perceptron? ", "2. How does pruning work? ",
+                         "3. What is a reward?"]
+
+    def invoke(self, prompt):
+        tokens = self._tokens(prompt)
+        time.sleep(self.latency + len(tokens) / self.tokens_per_s)
+        return ''.join(tokens)
+
+    async def ainvoke(self, prompt):
+        tokens = self._tokens(prompt)
+        await asyncio.sleep(self.latency + len(tokens) / self.tokens_per_s)
+        return ''.join(tokens)
+
+    def stream(self, prompt):
+        time.sleep(self.latency)
+        for token in self._tokens(prompt):
+            time.sleep(1 / self.tokens_per_s)
+            yield token
+
+    async def astream(self, prompt):
+        await asyncio.sleep(self.latency)
+        for token in self._tokens(prompt):
+            await asyncio.sleep(1 / self.tokens_per_s)
+            yield token
+
+
+class InMemoryVectorStore:
+    """Vector store stand-in with the interface of the real stores; exact search over a NumPy matrix."""
+
+    durable = False
+
+    def __init__(self, index_name="ai-chatbot-bench", dimension=768, latency=0.0):
+        self.index_name = index_name
+        self.dimension = dimension
+        self.latency = latency
+        self.records = {}
+        self.lock = threading.Lock()
+        self.ids, self.metadata, self.vectors = [], [], np.zeros((0, dimension), dtype=np.float32)
+
+    def create(self):
+        pass
+
+    def load(self):
+        pass
+
+    def count(self):
+        return len(self.records)
+
+    def upsert(self, vectors):
+        with self.lock:
+            for vector in vectors:
+                self.records[vector['id']] = (vector['values'], vector['metadata'])
+
+    def delete(self, ids):
+        with self.lock:
+            for vector_id in ids:
+                self.records.pop(vector_id, None)
+
+    def iter_metadata(self):
+        return (metadata for _, metadata in list(self.records.values()))
+
+    def flush(self):
+        with self.lock:
+            self.ids = list(self.records)
+            self.metadata = [self.records[vector_id][1] for vector_id in self.ids]
+            values = [self.records[vector_id][0] for vector_id in self.ids]
+            self.vectors = _normalize(np.asarray(values, dtype=np.float32).reshape(-1, self.dimension))
+
+    def query(self, embedding, k=5):
+        time.sleep(self.latency)
+        if len(self.ids) == 0:
+            return []
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        rows = exact_search(self.vectors, query, k)
+        return [(self.metadata[row], float(self.vectors[row] @ query)) for row in rows]
+
+    async def aquery(self, embedding, k=5):
+        return await asyncio.to_thread(self.query, embedding, k)
+
+    def query_many(self, embeddings, k=5):
+        time.sleep(self.latency)
+        if len(self.ids) == 0:
+            return [[] for _ in embeddings]
+        rows, scores = exact_search_many(self.vectors, _normalize(np.asarray(embeddings, dtype=np.float32)), k)
+        return [[(self.metadata[row], float(score)) for row, score in zip(top, top_scores)]
+                for top, top_scores in zip(rows, scores)]
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000
+    return {'p50_ms': float(np.percentile(samples, 50)), 'p95_ms': float(np.percentile(samples, 95)),
+            'p99_ms': float(np.percentile(samples, 99)), 'mean_ms': float(samples.mean()), 'n': len(samples)}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+
+
+def bench_ingestion(chapters, embedding_model, store, chunker=simple_chunks, embed_batch_size=64,
+                    upsert_batch_size=100, writers=4):
+    """
+    Run clean, chunk, embed and upsert over `chapters` one stage at a time, so
+    each stage's throughput is measured on its own. Returns per-stage seconds
+    and rates.
+    """
+    from src.clean_data import clean_text
+    from src.embedding_batcher import EmbeddingBatcher
+    from src.manifest import chunk_id
+    from src.upsert_writer import UpsertWriter
+
+    stages = {}
+    megabytes = sum(len(chapter['content'].encode('utf-8')) for chapter in chapters) / 1e6
+
+    start = time.perf_counter()
+    cleaned = [clean_text(chapter['content']) for chapter in chapters]
+    seconds = time.perf_counter() - start
+    stages['clean'] = {'seconds': seconds, 'mb_per_s': megabytes / seconds, 'chapters': len(chapters)}
+
+    start = time.perf_counter()
+    records = [{'id': chunk_id(chapter['title'], chapter['chapter_no'], chunk), 'title': chapter['title'],
+                'chapter_page_no': chapter['chapter_page_no'], 'content': chunk}
+               for chapter, content in zip(chapters, cleaned) for chunk in chunker(content)]
+    seconds = time.perf_counter() - start
+    stages['chunk'] = {'seconds': seconds, 'chunks_per_s': len(records) / seconds, 'chunks': len(records)}
+
+    start = time.perf_counter()
+    batcher = EmbeddingBatcher(embedding_model, batch_size=embed_batch_size)
+    vectors = [{'id': record['id'], 'values': embedding,
+                'metadata': {'title': record['title'], 'chapter_page_no': record['chapter_page_no'],
+                             'content': record['content']}}
+               for record, embedding in batcher.embed_stream(records)]
+    seconds = time.perf_counter() - start
+    stages['embed'] = {'seconds': seconds, 'chunks_per_s': len(vectors) / seconds, 'duplicates': batcher.duplicates}
+
+    start = time.perf_counter()
+    writer = UpsertWriter(store, writers=writers)
+    for i in range(0, len(vectors), upsert_batch_size):
+        writer.submit(vectors[i:i + upsert_batch_size])
+    writer.close()
+    store.flush()
+    seconds = time.perf_counter() - start
+    stages['upsert'] = {'seconds': seconds, 'vectors_per_s': len(vectors) / seconds}
+    stages['total_seconds'] = sum(stage['seconds'] for stage in stages.values())
+    return stages
+
+
+def bench_queries(pipeline, queries, model_idx=0):
+    """
+    Latency of retrieval (uncached query embedding + vector search), prompt
+    build and end-to-end predict for each query. The answer cache is cleared
+    before each predict so every query takes the full path.
+    """
+    from pipeline.augment_data import AugmentPromptPipeline
+    from src.augument_prompt import AugmentPrompt
+
+    embedding_model = pipeline.query_embedding.embedding_model
+    retrieval, prompt_build, end_to_end = [], [], []
+    for query in queries:
+        pipeline.answer_cache.clear()
+        start = time.perf_counter()
+        pipeline.predict(query, model_idx)
+        end_to_end.append(time.perf_counter() - start)
+
+        augment = AugmentPrompt(embedding_model=embedding_model, query=query, store=pipeline.store)
+        start = time.perf_counter()
+        results = pipeline.store.query(embedding_model.embed_query(query), k=augment.k)
+        retrieval.append(time.perf_counter() - start)
+
+        contexts, scores = augment._to_documents(results)
+        start = time.perf_counter()
+        AugmentPromptPipeline(embedding_model, query, store=pipeline.store)._build_prompt(augment, contexts, scores)
+        prompt_build.append(time.perf_counter() - start)
+    return {'retrieval': percentiles(retrieval), 'prompt_build': percentiles(prompt_build),
+            'end_to_end': percentiles(end_to_end)}
+
+
+def run_offline_benchmark(n_chapters=200, chapter_words=3000, n_queries=200, chunker=simple_chunks,
+                          embedding_model=None, llm_latency=0.05, tokens_per_s=2000, store_latency=0.0, seed=0):
+    """Ingest a synthetic corpus into local stand-ins and time the query path; returns a JSON-ready report."""
+    embedding_model = embedding_model or FakeEmbeddings()
+    store = InMemoryVectorStore(dimension=getattr(embedding_model, 'dimension', 768), latency=store_latency)
+    chapters = synthetic_corpus(n_chapters, chapter_words, seed=seed)
+    report = {'config': {'chapters': n_chapters, 'chapter_words': chapter_words, 'queries': n_queries,
+                         'embedding_model': getattr(embedding_model, 'model_name', type(embedding_model).__name__),
+                         'llm_latency_s': llm_latency, 'tokens_per_s': tokens_per_s, 'store_latency_s': store_latency,
+                         'seed': seed},
+              'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+    report['ingestion'] = bench_ingestion(chapters, embedding_model, store, chunker=chunker)
+    llms = [FakeChatModel(latency=llm_latency, tokens_per_s=tokens_per_s) for _ in range(3)]
+    with _scratch_cache_dir(), _whitespace_token_counter():
+        from pipeline.pipeline import Pipeline
+        pipeline = Pipeline(embedding_model=embedding_model, llms=llms, store=store)
+        report['query'] = bench_queries(pipeline, synthetic_queries(n_queries, seed=seed + 1))
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+@contextlib.contextmanager
+def _whitespace_token_counter():
+    # Prompt packing would otherwise load (and possibly download) the real tokenizer.
+    from src.context_packing import set_token_counter
+    set_token_counter(lambda text: len(text.split()))
+    try:
+        yield
+    finally:
+        set_token_counter(None)
+
+
+@contextlib.contextmanager
+def _scratch_cache_dir():
+    # On-disk caches from earlier runs would turn measured misses into hits.
+    previous = os.environ.get('CACHE_DIR')
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ['CACHE_DIR'] = cache_dir
+        try:
+            yield
+        finally:
+            if previous is None:
+                os.environ.pop('CACHE_DIR', None)
+            else:
+                os.environ['CACHE_DIR'] = previous
+
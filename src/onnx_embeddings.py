@@ -0,0 +1,118 @@
+import logging
+import os
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class OnnxEmbeddings:
+    """
+    Sentence embeddings from a sentence-transformers model exported to ONNX and
+    run on onnxruntime's CPU provider, optionally with dynamic int8 weights.
+    Mean pooling and L2 normalization match the PyTorch model, and the
+    embed_query/embed_documents interface matches HuggingFaceEmbeddings. The
+    export is done once and kept under `export_dir`.
+    """
+
+    def __init__(self, model_name, quantize=True, threads=None, max_seq_length=None, batch_size=32, export_dir=None):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.base_model_name = model_name
+        self.quantize = quantize
+        self.model_name = f"{model_name}:onnx{'-int8' if quantize else ''}"
+        self.max_seq_length = max_seq_length or int(os.getenv('EMBEDDING_MAX_SEQ_LENGTH', 384))
+        self.batch_size = batch_size
+        self.export_dir = export_dir or os.path.join(os.getenv('CACHE_DIR', '.cache'), 'onnx',
+                                                     model_name.replace('/', '--'))
+        model_path = self._export()
+        self.tokenizer = AutoTokenizer.from_pretrained(self.export_dir)
+
+        options = onnxruntime.SessionOptions()
+        threads = threads or int(os.getenv('EMBEDDING_THREADS', 0))
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _export(self):
+        model_path = os.path.join(self.export_dir, 'model.onnx')
+        quantized_path = os.path.join(self.export_dir, 'model_quantized.onnx')
+        if not os.path.exists(model_path):
+            from optimum.onnxruntime import ORTModelForFeatureExtraction
+            from transformers import AutoTokenizer
+            logger.info(f"Exporting {self.base_model_name} to ONNX")
+            ORTModelForFeatureExtraction.from_pretrained(self.base_model_name, export=True).save_pretrained(self.export_dir)
+            AutoTokenizer.from_pretrained(self.base_model_name).save_pretrained(self.export_dir)
+        if not self.quantize:
+            return model_path
+        if not os.path.exists(quantized_path):
+            from optimum.onnxruntime import ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            # Dynamic quantization: int8 weights, activations quantized per batch at run time.
+            config = AutoQuantizationConfig.avx2(is_static=False, per_channel=True)
+            ORTQuantizer.from_pretrained(self.export_dir, file_name='model.onnx').quantize(
+                save_dir=self.export_dir, quantization_config=config)
+        return quantized_path
+
+    def _encode(self, texts):
+        tokens = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_seq_length,
+                                return_tensors='np')
+        inputs = {name: tokens[name].astype(np.int64) for name in self.input_names if name in tokens}
+        hidden = self.session.run(None, inputs)[0]
+        mask = tokens['attention_mask'][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        embeddings = [None] * len(texts)
+        # Batches of similar length pad less; results go back in input order.
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.batch_size):
+            rows = order[start:start + self.batch_size]
+            for i, embedding in zip(rows, self._encode([texts[i] for i in rows])):
+                embeddings[i] = embedding.tolist()
+        return embeddings
+
+    def embed_query(self, text):
+        return self._encode([text])[0].tolist()
+
+
+def compare_embeddings(reference, candidate, texts, k=5):
+    """
+    Agreement of `candidate` with `reference` on `texts`: cosine similarity of
+    each pair of embeddings, and the overlap of each text's k nearest
+    neighbours among the other texts.
+    """
+    a = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    b = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    a /= np.linalg.norm(a, axis=1, keepdims=True)
+    b /= np.linalg.norm(b, axis=1, keepdims=True)
+    cosine = (a * b).sum(axis=1)
+    k = min(k, len(texts) - 1)
+    overlap = 0.0
+    if k > 0:
+        sims_a, sims_b = a @ a.T, b @ b.T
+        np.fill_diagonal(sims_a, -np.inf)
+        np.fill_diagonal(sims_b, -np.inf)
+        top_a = np.argsort(-sims_a, axis=1)[:, :k]
+        top_b = np.argsort(-sims_b, axis=1)[:, :k]
+        overlap = float(np.mean([len(set(x) & set(y)) / k for x, y in zip(top_a, top_b)]))
+    return {'cosine_mean': float(cosine.mean()), 'cosine_min': float(cosine.min()), f'neighbour_overlap@{k}': overlap}
+
+
+def benchmark_throughput(embedding_model, texts, queries=100):
+    """Texts per second of embed_documents over `texts`, and mean embed_query latency."""
+    embedding_model.embed_documents(texts[:8])
+    start = time.perf_counter()
+    embedding_model.embed_documents(texts)
+    documents_per_s = len(texts) / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for text in texts[:queries]:
+        embedding_model.embed_query(text[:200])
+    query_ms = (time.perf_counter() - start) * 1000 / min(queries, len(texts))
+    return {'documents_per_s': documents_per_s, 'query_latency_ms': query_ms}
@@ -0,0 +1,557 @@
+import asyncio
+import itertools
+import logging
+import os
+import random
+import re
+import threading
+import time
+from src.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REQUESTS = REGISTRY.counter(
+    'insight_provider_requests_total', 'LLM provider calls by outcome.', ('model', 'outcome'))
+WAIT_SECONDS = REGISTRY.histogram(
+    'insight_provider_wait_seconds', 'Time LLM calls waited before being sent.', ('model', 'reason'))
+CONCURRENCY_LIMIT = REGISTRY.gauge(
+    'insight_provider_concurrency_limit', 'Adaptive concurrency limit per provider.', ('model',))
+IN_FLIGHT = REGISTRY.gauge('insight_provider_in_flight', 'LLM calls in flight per provider.', ('model',))
+CIRCUIT_STATE = REGISTRY.gauge(
+    'insight_provider_circuit_state', 'Circuit breaker state: 0 closed, 1 half-open, 2 open.', ('model',))
+RETRY_BUDGET = REGISTRY.gauge('insight_provider_retry_budget', 'Retries the shared retry budget currently allows.')
+
+THROTTLED = re.compile(r'rate.?limit|too.?many.?requests|quota|resource.?exhausted|\b429\b', re.I)
+TRANSIENT = re.compile(r'overloaded|unavailable|timed?.?out|timeout|deadline.?exceeded|connection|'
+                       r'internal.?server.?error|bad.?gateway|\b50[0234]\b', re.I)
+
+
+class ProviderUnavailable(RuntimeError):
+    pass
+
+
+def _setting(name, default, model_idx):
+    # One value for every provider or a comma-separated list in selector order.
+    values = os.getenv(name, str(default)).split(',')
+    return float(values[min(model_idx, len(values) - 1)])
+
+
+def classify_error(error):
+    """'throttled' or 'transient' for errors worth retrying, None for the rest (bad request, auth, ...)."""
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    if status == 429:
+        return 'throttled'
+    if isinstance(status, int):
+        return 'transient' if status >= 500 else None
+    text = f"{type(error).__name__}: {error}"
+    if THROTTLED.search(text):
+        return 'throttled'
+    if isinstance(error, (TimeoutError, ConnectionError)) or TRANSIENT.search(text):
+        return 'transient'
+    return None
+
+
+class TokenBucket:
+    """
+    `per_minute` units a minute, with bursts of up to a minute's worth.
+    reserve() always takes the units and returns how long the caller must wait
+    for the balance to cover them, so waiters are served in arrival order.
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount=1):
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount):
+        if not self.rate:
+            return
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AdaptiveLimit:
+    """
+    AIMD concurrency limit: each success adds 1/limit (about one more slot per
+    round of calls), throttling or a transient failure halves it. Until the
+    first failure each success adds a whole slot, doubling the limit every
+    round (slow start). Failures of calls sent before the last decrease are
+    ignored, so one burst of failures halves the limit once.
+    """
+
+    def __init__(self, maximum, initial=4, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.decreased = 0.0
+        self.slow_start = True
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def _free(self):
+        return self.in_flight < int(self.limit)
+
+    def try_acquire(self):
+        with self.condition:
+            if not self._free():
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self, timeout):
+        with self.condition:
+            if not self.condition.wait_for(self._free, timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    async def aacquire(self, timeout):
+        # Polled, so that waiting never blocks the event loop on the condition.
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        while not self.try_acquire():
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, 0.05)
+        return True
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def increase(self):
+        with self.condition:
+            self.limit = min(self.maximum, self.limit + (1 if self.slow_start else 1 / self.limit))
+            self.condition.notify_all()
+
+    def decrease(self, sent):
+        with self.condition:
+            if sent >= self.decreased:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.decreased = time.monotonic()
+                self.slow_start = False
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed calls and rejects calls for
+    `cooldown` seconds. Then a single probe call is let through (half-open);
+    its outcome closes the circuit or opens it again.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, failures=5, cooldown=30.0):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self.probing = False
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                self.state = self.OPEN
+                self.opened = time.monotonic()
+                self.probing = False
+
+    def release_probe(self):
+        # A probe that ended without an outcome (cancelled, stream abandoned) lets the next call probe.
+        with self.lock:
+            self.probing = False
+
+
+class RetryBudget:
+    """
+    Shared by every provider so that retries cannot multiply the load during
+    an outage: each call earns `ratio` of a retry, each retry spends one, and
+    `min_per_second` retries accrue regardless so that quiet periods can retry.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=0.5, cap=20.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.cap = cap
+        self.balance = cap
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _accrue(self, amount):
+        now = time.monotonic()
+        self.balance = min(self.cap, self.balance + amount + (now - self.updated) * self.min_per_second)
+        self.updated = now
+
+    def deposit(self):
+        with self.lock:
+            self._accrue(self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            self._accrue(0)
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+class _Provider:
+    def __init__(self, idx):
+        self.idx = idx
+        self.requests = TokenBucket(_setting('PROVIDER_RPM', 0, idx))
+        self.tokens = TokenBucket(_setting('PROVIDER_TPM', 0, idx))
+        self.limit = AdaptiveLimit(int(_setting('PROVIDER_CONCURRENCY', 16, idx)))
+        self.breaker = CircuitBreaker(int(_setting('PROVIDER_BREAKER_FAILURES', 5, idx)),
+                                      _setting('PROVIDER_BREAKER_COOLDOWN', 30, idx))
+
+
+class ProviderGateway:
+    """
+    Shared front for the LLM clients of a LazyModels sequence, one state per
+    provider for every session of the process. A call is routed to its model,
+    or to the next configured one while that model's circuit is open; waits
+    for the request and token buckets and for a slot under the adaptive
+    concurrency limit; and on throttling or a transient error is retried with
+    full-jitter backoff while the shared retry budget allows. Calls that would
+    wait longer than `queue_timeout` fail fast with ProviderUnavailable.
+    """
+
+    def __init__(self, models, max_attempts=None, queue_timeout=None, reroute=None):
+        self.models = models
+        self.providers = [_Provider(idx) for idx in range(len(models))]
+        self.max_attempts = max_attempts or int(os.getenv('PROVIDER_MAX_ATTEMPTS', 3))
+        self.queue_timeout = queue_timeout or float(os.getenv('PROVIDER_QUEUE_TIMEOUT', 30))
+        self.reroute = reroute if reroute is not None else os.getenv('PROVIDER_REROUTE', '1') == '1'
+        self.output_tokens = int(os.getenv('PROVIDER_OUTPUT_TOKENS', 512))
+        self.backoff_base = float(os.getenv('PROVIDER_BACKOFF_BASE', 0.5))
+        self.backoff_max = float(os.getenv('PROVIDER_BACKOFF_MAX', 8))
+        self.retry_budget = RetryBudget(float(os.getenv('PROVIDER_RETRY_RATIO', 0.2)))
+        self.unconfigured = set()
+        self.gated = {}
+        for provider in self.providers:
+            self._export(provider)
+
+    def __len__(self):
+        return len(self.models)
+
+    def __getitem__(self, idx):
+        # Builds the client now, as indexing the LazyModels would.
+        self.models[idx]
+        if idx not in self.gated:
+            self.gated[idx] = GatedModel(self, idx)
+        return self.gated[idx]
+
+    def state(self):
+        return [{'model': provider.idx, 'concurrency_limit': provider.limit.limit,
+                 'in_flight': provider.limit.in_flight, 'circuit': provider.breaker.state}
+                for provider in self.providers]
+
+    def _export(self, provider):
+        CONCURRENCY_LIMIT.set(provider.limit.limit, model=provider.idx)
+        IN_FLIGHT.set(provider.limit.in_flight, model=provider.idx)
+        CIRCUIT_STATE.set(provider.breaker.state, model=provider.idx)
+        RETRY_BUDGET.set(self.retry_budget.balance)
+
+    def _estimate_tokens(self, prompt):
+        # About four characters a token; reconciled with the reported usage when the client gives one.
+        text = prompt if isinstance(prompt, str) else str(prompt)
+        return len(text) // 4 + self.output_tokens
+
+    def _configured(self, idx):
+        if idx in self.unconfigured:
+            return False
+        try:
+            self.models[idx]
+        except Exception as e:
+            logger.warning(f"Model {idx} cannot take rerouted calls: {e}")
+            self.unconfigured.add(idx)
+            return False
+        return True
+
+    def _route(self, idx):
+        n_models = len(self.providers)
+        candidates = [idx] + ([(idx + i) % n_models for i in range(1, n_models)] if self.reroute else [])
+        for candidate in candidates:
+            if candidate != idx and not self._configured(candidate):
+                continue
+            provider = self.providers[candidate]
+            allowed = provider.breaker.allow()
+            self._export(provider)
+            if allowed:
+                if candidate != idx:
+                    logger.warning(f"Circuit of model {idx} is open; rerouting to model {candidate}")
+                    REQUESTS.inc(model=idx, outcome='rerouted')
+                return provider
+        REQUESTS.inc(model=idx, outcome='rejected')
+        raise ProviderUnavailable(f"Model {idx} is unavailable (circuit open) and no other model can take the call")
+
+    def _admit(self, provider, tokens):
+        # Reserves the request and its estimated tokens; returns the seconds to wait before sending.
+        wait = max(provider.requests.reserve(1), provider.tokens.reserve(tokens))
+        if wait > self.queue_timeout:
+            provider.requests.refund(1)
+            provider.tokens.refund(tokens)
+            REQUESTS.inc(model=provider.idx, outcome='rejected')
+            raise ProviderUnavailable(f"Model {provider.idx} is rate limited for another {wait:.0f}s")
+        WAIT_SECONDS.observe(wait, model=provider.idx, reason='rate_limit')
+        return wait
+
+    def _acquired(self, provider, acquired, started):
+        if not acquired:
+            REQUESTS.inc(model=provider.idx, outcome='rejected')
+            raise ProviderUnavailable(f"Model {provider.idx} had no free slot within {self.queue_timeout:.0f}s")
+        WAIT_SECONDS.observe(time.perf_counter() - started, model=provider.idx, reason='concurrency')
+        self._export(provider)
+
+    def _enter(self, provider, tokens):
+        """Wait for the rate limits and a slot; returns when the call was sent."""
+        try:
+            time.sleep(self._admit(provider, tokens))
+            started = time.perf_counter()
+            self._acquired(provider, provider.limit.acquire(self.queue_timeout), started)
+        except BaseException:
+            # A half-open probe that is never sent must not keep the circuit waiting for its outcome.
+            provider.breaker.release_probe()
+            raise
+        return time.monotonic()
+
+    async def _aenter(self, provider, tokens):
+        try:
+            await asyncio.sleep(self._admit(provider, tokens))
+            started = time.perf_counter()
+            self._acquired(provider, await provider.limit.aacquire(self.queue_timeout), started)
+        except BaseException:
+            provider.breaker.release_probe()
+            raise
+        return time.monotonic()
+
+    def _release(self, provider, settled=True):
+        provider.limit.release()
+        if not settled:
+            # Ended without an outcome (cancelled, stream abandoned): a probe in flight may be retried.
+            provider.breaker.release_probe()
+        self._export(provider)
+
+    def _succeeded(self, provider, tokens, response=None):
+        provider.breaker.record_success()
+        provider.limit.increase()
+        REQUESTS.inc(model=provider.idx, outcome='success')
+        usage = getattr(response, 'usage_metadata', None)
+        if usage and usage.get('total_tokens'):
+            provider.tokens.refund(tokens - usage['total_tokens'])
+
+    def _failed(self, provider, error, attempt, sent):
+        """Record a failed call; returns the backoff before the next attempt, or None to give up."""
+        kind = classify_error(error)
+        if kind is None:
+            # The provider answered; the request itself was at fault.
+            provider.breaker.record_success()
+            REQUESTS.inc(model=provider.idx, outcome='error')
+            return None
+        provider.breaker.record_failure()
+        provider.limit.decrease(sent)
+        REQUESTS.inc(model=provider.idx, outcome=kind)
+        logger.warning(f"Model {provider.idx} call failed ({kind}, attempt {attempt + 1}): {error}")
+        if attempt + 1 >= self.max_attempts or not self.retry_budget.withdraw():
+            return None
+        REQUESTS.inc(model=provider.idx, outcome='retry')
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        WAIT_SECONDS.observe(delay, model=provider.idx, reason='backoff')
+        return delay
+
+    def call(self, idx, method, prompt, on_served=None):
+        tokens = self._estimate_tokens(prompt)
+        self.retry_budget.deposit()
+        for attempt in itertools.count():
+            provider = self._route(idx)
+            sent = self._enter(provider, tokens)
+            try:
+                response = getattr(self.models[provider.idx], method)(prompt)
+            except Exception as e:
+                delay = self._failed(provider, e, attempt, sent)
+                if delay is None:
+                    raise
+            except BaseException:
+                provider.breaker.release_probe()
+                raise
+            else:
+                self._succeeded(provider, tokens, response)
+                _served(on_served, provider)
+                return response
+            finally:
+                self._release(provider)
+            time.sleep(delay)
+
+    async def acall(self, idx, method, prompt, on_served=None):
+        tokens = self._estimate_tokens(prompt)
+        self.retry_budget.deposit()
+        for attempt in itertools.count():
+            provider = self._route(idx)
+            sent = await self._aenter(provider, tokens)
+            try:
+                response = await getattr(self.models[provider.idx], method)(prompt)
+            except Exception as e:
+                delay = self._failed(provider, e, attempt, sent)
+                if delay is None:
+                    raise
+            except BaseException:
+                provider.breaker.release_probe()
+                raise
+            else:
+                self._succeeded(provider, tokens, response)
+                _served(on_served, provider)
+                return response
+            finally:
+                self._release(provider)
+            await asyncio.sleep(delay)
+
+    def stream(self, idx, prompt, on_served=None):
+        # Failures before the first chunk are retried like any call; after it, the caller has seen text.
+        tokens = self._estimate_tokens(prompt)
+        self.retry_budget.deposit()
+        for attempt in itertools.count():
+            provider = self._route(idx)
+            sent = self._enter(provider, tokens)
+            try:
+                chunks = iter(self.models[provider.idx].stream(prompt))
+                first = next(chunks, _END)
+                break
+            except Exception as e:
+                self._release(provider)
+                delay = self._failed(provider, e, attempt, sent)
+                if delay is None:
+                    raise
+            except BaseException:
+                self._release(provider, settled=False)
+                raise
+            time.sleep(delay)
+        _served(on_served, provider)
+        settled = False
+        try:
+            if first is not _END:
+                yield first
+                yield from chunks
+        except Exception as e:
+            settled = True
+            self._failed(provider, e, self.max_attempts, sent)
+            raise
+        else:
+            settled = True
+            self._succeeded(provider, tokens)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            self._release(provider, settled)
+
+    async def astream(self, idx, prompt, on_served=None):
+        tokens = self._estimate_tokens(prompt)
+        self.retry_budget.deposit()
+        for attempt in itertools.count():
+            provider = self._route(idx)
+            sent = await self._aenter(provider, tokens)
+            try:
+                chunks = self.models[provider.idx].astream(prompt).__aiter__()
+                try:
+                    first = await chunks.__anext__()
+                except StopAsyncIteration:
+                    first = _END
+                break
+            except Exception as e:
+                self._release(provider)
+                delay = self._failed(provider, e, attempt, sent)
+                if delay is None:
+                    raise
+            except BaseException:
+                self._release(provider, settled=False)
+                raise
+            await asyncio.sleep(delay)
+        _served(on_served, provider)
+        settled = False
+        try:
+            if first is not _END:
+                yield first
+                async for chunk in chunks:
+                    yield chunk
+        except Exception as e:
+            settled = True
+            self._failed(provider, e, self.max_attempts, sent)
+            raise
+        else:
+            settled = True
+            self._succeeded(provider, tokens)
+        finally:
+            if hasattr(chunks, 'aclose'):
+                await chunks.aclose()
+            self._release(provider, settled)
+
+
+_END = object()
+
+
+def _served(on_served, provider):
+    # A rerouted call is answered by another model than the one asked for; callers key caches and labels on it.
+    if on_served is not None:
+        on_served(provider.idx)
+
+
+class GatedModel:
+    """
+    One model as seen through the gateway, with the invoke/ainvoke/stream/astream
+    interface of the client. `on_served`, if given, is called with the index of
+    the model that actually answered, which differs after a reroute.
+    """
+
+    def __init__(self, gateway, idx):
+        self.gateway = gateway
+        self.idx = idx
+
+    def invoke(self, prompt, on_served=None):
+        return self.gateway.call(self.idx, 'invoke', prompt, on_served)
+
+    async def ainvoke(self, prompt, on_served=None):
+        return await self.gateway.acall(self.idx, 'ainvoke', prompt, on_served)
+
+    def stream(self, prompt, on_served=None):
+        return self.gateway.stream(self.idx, prompt, on_served)
+
+    def astream(self, prompt, on_served=None):
+        return self.gateway.astream(self.idx, prompt, on_served)
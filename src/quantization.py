@@ -0,0 +1,151 @@
+import os
+import time
+import numpy as np
+from src.ann_index import _normalize, exact_search
+
+
+class ScalarQuantizer:
+    """
+    Compact codes for the first search pass. 'float16' halves each vector;
+    'int8' maps every dimension onto 256 levels between its minimum and maximum
+    over the corpus (per-dimension scale and offset computed at build time),
+    a quarter of float32. Scores on codes are approximate and meant to be
+    re-ranked against the full-precision vectors.
+    """
+
+    def __init__(self, mode='int8'):
+        if mode not in ('float16', 'int8'):
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        self.mode = mode
+        self.offset = None
+        self.scale = None
+
+    def fit(self, vectors, chunk_size=65536):
+        if self.mode == 'float16':
+            return self
+        low = np.full(vectors.shape[1], np.inf, dtype=np.float32)
+        high = np.full(vectors.shape[1], -np.inf, dtype=np.float32)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+            low = np.minimum(low, chunk.min(axis=0))
+            high = np.maximum(high, chunk.max(axis=0))
+        self.offset = low
+        self.scale = np.maximum(high - low, 1e-12) / 255
+        return self
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.mode == 'float16':
+            return vectors.astype(np.float16)
+        return np.clip(np.rint((vectors - self.offset) / self.scale), 0, 255).astype(np.uint8)
+
+    def encode_to(self, vectors, path, chunk_size=65536):
+        # Encode into a temporary file and rename it, so a reader mapping `path` never sees it truncated.
+        dtype = np.float16 if self.mode == 'float16' else np.uint8
+        codes = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=dtype, shape=vectors.shape)
+        for start in range(0, len(vectors), chunk_size):
+            codes[start:start + chunk_size] = self.encode(vectors[start:start + chunk_size])
+        codes.flush()
+        del codes
+        os.replace(path + '.tmp', path)
+
+    def score(self, codes, query, block_bytes=1 << 19):
+        """
+        Approximate scores of all codes against `query`. The int8 scale and
+        offset are folded into the query, and codes are widened to float32 one
+        cache-sized block at a time into a reused buffer.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self.mode == 'int8':
+            bias = float(self.offset @ query)
+            query = query * self.scale
+        else:
+            bias = 0.0
+            query = query * np.float32(2.0 ** 112)
+        rows = max(1, block_bytes // (4 * codes.shape[1]))
+        dtype = np.int32 if self.mode == 'float16' else np.float32
+        buffer = np.empty((min(rows, len(codes)), codes.shape[1]), dtype=dtype)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), rows):
+            block = buffer[:len(codes[start:start + rows])]
+            if self.mode == 'int8':
+                np.copyto(block, codes[start:start + rows])
+            else:
+                _widen_half(codes[start:start + rows], block)
+            np.matmul(block.view(np.float32), query, out=scores[start:start + len(block)])
+        return scores + bias
+
+    def save(self, path, build_id=None):
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, mode=self.mode, offset=self.offset if self.offset is not None else np.zeros(0),
+                     scale=self.scale if self.scale is not None else np.zeros(0), build_id=build_id or '')
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, build_id=None):
+        """The saved quantizer for `build_id`, or None if there is none or it was fitted for another build."""
+        if not os.path.exists(path):
+            return None
+        params = np.load(path)
+        saved_build = str(params['build_id']) if 'build_id' in params else ''
+        if saved_build != (build_id or ''):
+            return None
+        quantizer = cls(str(params['mode']))
+        if quantizer.mode == 'int8':
+            quantizer.offset, quantizer.scale = params['offset'], params['scale']
+        return quantizer
+
+
+def _widen_half(codes, out):
+    # numpy's float16 cast is scalar code. Moving the sign bit and shifting the other 15 bits into place
+    # gives a float32 equal to the half value times 2**-112 (subnormals included); score() scales the query back.
+    np.copyto(out, codes.view(np.int16))
+    np.left_shift(out, 13, out=out)
+    np.bitwise_and(out, np.int32(-0x70000001), out=out)
+
+
+def rerank(vectors, rows, query, k):
+    # Exact float32 scores for a small candidate set, read in row order from the memory map.
+    rows = np.sort(rows)
+    scores = np.asarray(vectors[rows] @ query)
+    k = min(k, len(rows))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return rows[top], scores[top]
+
+
+def benchmark_quantization(vectors, modes=('float16', 'int8'), k=5, rerank_factors=(1, 4, 10), n_queries=200,
+                           noise=0.05, seed=0):
+    """
+    recall@k and latency of code search + exact re-ranking for each mode and
+    re-rank depth, against exact float32 search, plus bytes per vector.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    queries = np.asarray(vectors[np.sort(rows)], dtype=np.float32)
+    queries = _normalize(queries + rng.normal(0, noise, queries.shape).astype(np.float32))
+
+    start = time.perf_counter()
+    truth = [set(exact_search(vectors, q, k).tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    float32_bytes = vectors.shape[1] * 4
+
+    results = [{'mode': 'float32', 'bytes_per_vector': float32_bytes, 'memory_ratio': 1.0,
+                f'recall@{k}': 1.0, 'latency_ms': exact_ms}]
+    for mode in modes:
+        quantizer = ScalarQuantizer(mode).fit(vectors)
+        codes = quantizer.encode(vectors)
+        for factor in rerank_factors:
+            hits = 0
+            start = time.perf_counter()
+            for q, expected in zip(queries, truth):
+                approx = quantizer.score(codes, q)
+                n_candidates = min(k * factor, len(approx))
+                candidates = np.argpartition(-approx, n_candidates - 1)[:n_candidates]
+                found, _ = rerank(vectors, candidates, q, k)
+                hits += len(expected.intersection(found.tolist()))
+            latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            results.append({'mode': mode, 'rerank_factor': factor, 'bytes_per_vector': codes.itemsize * codes.shape[1],
+                            'memory_ratio': float32_bytes / (codes.itemsize * codes.shape[1]),
+                            f'recall@{k}': hits / (k * len(queries)), 'latency_ms': latency_ms})
+    return results
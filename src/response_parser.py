@@ -0,0 +1,92 @@
+import asyncio
+import re
+
+FOLLOW_UP_MARKER = 'Follow up questions:'
+
+
+def chunk_text(chunk):
+    # Chat models yield message chunks (content may be a list of parts); Together yields str.
+    if isinstance(chunk, str):
+        return chunk
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(part if isinstance(part, str) else part.get('text', '') for part in content)
+
+
+def iter_async(async_iterator):
+    # Drive an async iterator from synchronous code (Streamlit renders synchronously).
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(async_iterator.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        if hasattr(async_iterator, 'aclose'):
+            loop.run_until_complete(async_iterator.aclose())
+        loop.close()
+
+
+def parse_response(text):
+    parts = text.split(FOLLOW_UP_MARKER)
+    if len(parts) < 2:
+        # Log an error or handle gracefully
+        answer = text
+        follow_up = []
+    else:
+        follow_up = parts[1].split('?')
+        answer = parts[0] + " ".join(follow_up[-1])
+        follow_up = [re.sub(r'^\s*\d+\.\s*', '', text) for text in follow_up]
+    return answer, follow_up
+
+
+class StreamingAnswer:
+    """
+    Iterate to receive the answer text as the model produces it. Text from the
+    follow-up marker onwards is held back; once iteration ends, `answer` and
+    `follow_up` hold the same values Pipeline.predict would return.
+    """
+
+    def __init__(self, chunks, on_complete=None):
+        self.chunks = chunks
+        self.on_complete = on_complete
+        self.answer = None
+        self.follow_up = None
+        self.result = None
+
+    @classmethod
+    def from_result(cls, answer, follow_up):
+        # Wrap an already complete (e.g. cached) result in the streaming interface.
+        streaming_answer = cls(iter([]))
+        streaming_answer.result = (answer, follow_up)
+        return streaming_answer
+
+    def __iter__(self):
+        if self.result is not None:
+            yield self.result[0]
+            self.answer, self.follow_up = self.result
+            return
+        text = ""
+        emitted = 0
+        marker_seen = False
+        for chunk in self.chunks:
+            text += chunk_text(chunk)
+            if marker_seen:
+                continue
+            marker_at = text.find(FOLLOW_UP_MARKER, max(0, emitted - len(FOLLOW_UP_MARKER)))
+            if marker_at != -1:
+                marker_seen = True
+                safe_end = marker_at
+            else:
+                # Hold back a tail that could be the start of the marker.
+                safe_end = max(emitted, len(text) - len(FOLLOW_UP_MARKER) + 1)
+            if safe_end > emitted:
+                yield text[emitted:safe_end]
+                emitted = safe_end
+        if not marker_seen and len(text) > emitted:
+            yield text[emitted:]
+        self.answer, self.follow_up = parse_response(text)
+        if self.on_complete is not None:
+            self.on_complete(self.answer, self.follow_up)
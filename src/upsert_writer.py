@@ -0,0 +1,60 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class UpsertWriter:
+    """
+    Small pool of threads that upsert batches into a vector store. submit()
+    blocks once `max_in_flight` batches are pending, which pushes back on the
+    embedder instead of buffering the corpus. Failed upserts are retried with
+    jittered exponential backoff; `on_done(tag)` runs after each acked batch.
+    """
+
+    def __init__(self, store, writers=4, max_in_flight=None, retries=5, backoff=0.5, on_done=None):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=writers)
+        self.slots = threading.Semaphore(max_in_flight or 2 * writers)
+        self.retries = retries
+        self.backoff = backoff
+        self.on_done = on_done
+        self.lock = threading.Lock()
+        self.errors = []
+        self.upserted = 0
+
+    def _upsert(self, batch, tag):
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    self.store.upsert(batch)
+                    break
+                except Exception as e:
+                    if attempt == self.retries:
+                        raise
+                    delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                    logger.warning(f"Upsert failed ({e}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+            with self.lock:
+                self.upserted += len(batch)
+                if self.on_done is not None:
+                    self.on_done(tag)
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            self.slots.release()
+
+    def submit(self, batch, tag=None):
+        if self.errors:
+            raise self.errors[0]
+        self.slots.acquire()
+        self.executor.submit(self._upsert, batch, tag)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
+        return self.upserted
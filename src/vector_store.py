@@ -0,0 +1,366 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from src.ann_index import IVFIndex, _normalize, _stamped_path, exact_search, exact_search_many
+from src.quantization import ScalarQuantizer, rerank
+
+# Files that belong to one generation of the local index.
+GENERATION_FILES = ('vectors.npy', 'metadata.jsonl', 'codes.npy', 'ivf_centroids.npy', 'ivf_list_rows.npy',
+                    'ivf_offsets.npy')
+
+
+class PineconeStore:
+    durable = True
+
+    def __init__(self, index_name="ai-chatbot", dimension=768):
+        self.index_name = index_name
+        self.dimension = dimension
+        self.pc_index = None
+
+    # pinecone is imported on use, so the local backend runs without it installed.
+    def create(self):
+        from pinecone import Pinecone, ServerlessSpec
+        pc = Pinecone(os.getenv('PINECONE_API'))
+        index_list = [idx['name'] for idx in pc.list_indexes()]
+        if self.index_name not in index_list:
+            pc.create_index(name=self.index_name, spec=ServerlessSpec(
+                cloud='aws', region='us-east-1'), dimension=self.dimension)
+        timeout = 60
+        start_time = time.time()
+        while not pc.describe_index(self.index_name).status['ready']:
+            if time.time() - start_time > timeout:
+                raise TimeoutError("Timeout")
+            time.sleep(1)
+        self.pc_index = pc.Index(self.index_name)
+
+    def load(self):
+        from pinecone import Pinecone
+        self.pc_index = Pinecone(os.getenv('PINECONE_API')).Index(self.index_name)
+
+    def count(self):
+        return self.pc_index.describe_index_stats()['total_vector_count']
+
+    def upsert(self, vectors):
+        self.pc_index.upsert(vectors=vectors)
+
+    def delete(self, ids):
+        for i in range(0, len(ids), 1000):
+            self.pc_index.delete(ids=ids[i:i + 1000])
+
+    def iter_metadata(self):
+        for ids in self.pc_index.list():
+            for vector in self.pc_index.fetch(ids=ids).vectors.values():
+                yield vector.metadata
+
+    def flush(self):
+        pass
+
+    def query(self, embedding, k=5):
+        response = self.pc_index.query(vector=list(embedding), top_k=k, include_metadata=True)
+        return [(match['metadata'], match['score']) for match in response['matches']]
+
+    async def aquery(self, embedding, k=5):
+        return await asyncio.to_thread(self.query, embedding, k)
+
+    def query_many(self, embeddings, k=5):
+        # One request per query, with the round trips overlapped.
+        if not embeddings:
+            return []
+        with ThreadPoolExecutor(max_workers=min(16, len(embeddings))) as executor:
+            return list(executor.map(lambda embedding: self.query(embedding, k), embeddings))
+
+
+class LocalVectorStore:
+    """
+    In-process vector index kept on disk as a memory-mapped matrix of
+    L2-normalized vectors (vectors-<generation>.npy) with one JSON line of id
+    and metadata per row (metadata-<generation>.jsonl). Every flush writes a
+    new generation and publishes it by replacing generation.json, so readers
+    never see vectors and metadata from different flushes. The previous
+    generation is kept until the next flush. Search is an exact
+    dot-product top-k, or an IVF scan once the index holds at least
+    `ann_min_vectors` rows. With `quantization` set to 'float16' or 'int8', the
+    scan reads compact codes (codes-<generation>.npy) and only the best `rerank_factor * k` candidates are re-scored
+    against the full-precision matrix.
+    """
+    # Upserts are buffered until flush(), so an acked upsert is not yet on disk.
+    durable = False
+
+    def __init__(self, index_name="ai-chatbot", dimension=768, index_dir=None,
+                 ann_min_vectors=None, nlist=None, nprobe=None, quantization=None, rerank_factor=None):
+        self.index_name = index_name
+        self.dimension = dimension
+        self.index_dir = os.path.join(index_dir or os.getenv('LOCAL_INDEX_DIR', 'vector_index'), index_name)
+        self.ann_min_vectors = ann_min_vectors or int(os.getenv('IVF_MIN_VECTORS', 20000))
+        self.nlist = nlist or (int(os.getenv('IVF_NLIST')) if os.getenv('IVF_NLIST') else None)
+        self.nprobe = nprobe or int(os.getenv('IVF_NPROBE', 16))
+        self.quantization = (quantization or os.getenv('VECTOR_QUANTIZATION', 'none')).lower()
+        self.rerank_factor = rerank_factor or int(os.getenv('RERANK_FACTOR', 4))
+        self.generation = None
+        self.ann_index = None
+        self.quantizer = None
+        self.codes = None
+        self.vectors = np.zeros((0, dimension), dtype=np.float32)
+        self.ids = []
+        self.metadata = []
+        self.id_to_row = {}
+        self.pending = {}
+        self.pending_deletes = set()
+        self.spill = None
+        self.spill_rows = 0
+
+    @property
+    def generation_path(self):
+        return os.path.join(self.index_dir, 'generation.json')
+
+    @property
+    def vectors_path(self):
+        return _stamped_path(self.index_dir, 'vectors.npy', self.generation)
+
+    @property
+    def metadata_path(self):
+        return _stamped_path(self.index_dir, 'metadata.jsonl', self.generation)
+
+    @property
+    def codes_path(self):
+        return _stamped_path(self.index_dir, 'codes.npy', self.generation)
+
+    @property
+    def quantizer_path(self):
+        return os.path.join(self.index_dir, 'quantizer.npz')
+
+    @property
+    def spill_path(self):
+        return os.path.join(self.index_dir, 'pending.f32')
+
+    def create(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        self.load()
+
+    def load(self, retries=3):
+        for attempt in range(retries):
+            try:
+                return self._load()
+            except FileNotFoundError:
+                # Two newer generations were published after generation.json was read, and this one
+                # was removed; read generation.json again.
+                if attempt == retries - 1:
+                    raise
+
+    def _load(self):
+        rows = None
+        if os.path.exists(self.generation_path):
+            with open(self.generation_path, encoding='utf-8') as f:
+                current = json.load(f)
+            self.generation, rows = current['generation'], current['rows']
+        if self.generation is None and not os.path.exists(self.vectors_path):
+            return
+        vectors = np.load(self.vectors_path, mmap_mode='r')
+        ids, metadata = [], []
+        with open(self.metadata_path, encoding='utf-8') as f:
+            for line in f:
+                row = json.loads(line)
+                ids.append(row['id'])
+                metadata.append(row['metadata'])
+        if len(vectors) != len(ids) or rows not in (None, len(ids)):
+            raise ValueError(f"Local index {self.index_dir} is inconsistent: {len(vectors)} vectors, "
+                             f"{len(ids)} metadata rows, {rows} published rows")
+        self.vectors, self.ids, self.metadata = vectors, ids, metadata
+        self.id_to_row = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self.ann_index = IVFIndex.load(self.index_dir, nprobe=self.nprobe, build_id=self.generation)
+        if self.ann_index is not None and self.ann_index.ntotal != len(self.ids):
+            # Stale index from an interrupted build; fall back to exact search.
+            self.ann_index = None
+        self.quantizer, self.codes = None, None
+        if self.quantization != 'none' and os.path.exists(self.codes_path):
+            quantizer = ScalarQuantizer.load(self.quantizer_path, build_id=self.generation)
+            codes = np.load(self.codes_path, mmap_mode='r')
+            if quantizer is not None and quantizer.mode == self.quantization and len(codes) == len(self.ids):
+                self.quantizer, self.codes = quantizer, codes
+
+    def build_codes(self):
+        if self.quantization == 'none' or not self.ids:
+            self.quantizer, self.codes = None, None
+            return
+        quantizer = ScalarQuantizer(self.quantization).fit(self.vectors)
+        quantizer.encode_to(self.vectors, self.codes_path)
+        quantizer.save(self.quantizer_path, build_id=self.generation)
+        self.quantizer, self.codes = quantizer, np.load(self.codes_path, mmap_mode='r')
+
+    def memory_report(self):
+        float32_bytes = self.vectors.nbytes if self.ids else 0
+        scanned_bytes = self.codes.nbytes if self.codes is not None else float32_bytes
+        return {'vectors': len(self.ids), 'float32_bytes': float32_bytes, 'scanned_bytes': scanned_bytes,
+                'memory_ratio': float32_bytes / scanned_bytes if scanned_bytes else 1.0}
+
+    def build_index(self):
+        if len(self.ids) < self.ann_min_vectors:
+            self.ann_index = None
+            if os.path.exists(os.path.join(self.index_dir, 'ivf.json')):
+                os.remove(os.path.join(self.index_dir, 'ivf.json'))
+            return
+        index = IVFIndex(nlist=self.nlist, nprobe=self.nprobe).build(self.vectors)
+        index.save(self.index_dir, build_id=self.generation)
+        self.ann_index = IVFIndex.load(self.index_dir, nprobe=self.nprobe, build_id=self.generation)
+
+    def count(self):
+        deleted = sum(1 for chunk_id in self.pending_deletes if chunk_id in self.id_to_row)
+        return len(self.ids) - deleted + sum(1 for chunk_id in self.pending if chunk_id not in self.id_to_row)
+
+    def upsert(self, vectors):
+        # Buffer writes; they become visible to queries after flush(). Vectors are
+        # appended to a float32 spill file so that a large ingest does not hold them in memory.
+        if not vectors:
+            return
+        if self.spill is None:
+            os.makedirs(self.index_dir, exist_ok=True)
+            self.spill = open(self.spill_path, 'wb')
+            self.spill_rows = 0
+        _normalize(np.asarray([vector['values'] for vector in vectors], dtype=np.float32)).tofile(self.spill)
+        for row, vector in enumerate(vectors, start=self.spill_rows):
+            self.pending_deletes.discard(vector['id'])
+            self.pending[vector['id']] = (row, vector['metadata'])
+        self.spill_rows += len(vectors)
+
+    def iter_metadata(self):
+        return iter(self.metadata)
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            self.pending.pop(chunk_id, None)
+            self.pending_deletes.add(chunk_id)
+
+    def flush(self):
+        if not self.pending and not self.pending_deletes:
+            return
+        os.makedirs(self.index_dir, exist_ok=True)
+        keep_rows = [row for row, chunk_id in enumerate(self.ids) if chunk_id not in self.pending_deletes]
+        new_ids = [chunk_id for chunk_id in self.pending if chunk_id not in self.id_to_row]
+        n_rows = len(keep_rows) + len(new_ids)
+        # The new generation's files are invisible to readers until generation.json names them.
+        previous = self.generation
+        generation = f'{time.time_ns():x}'
+        vectors_path = _stamped_path(self.index_dir, 'vectors.npy', generation)
+        metadata_path = _stamped_path(self.index_dir, 'metadata.jsonl', generation)
+        matrix = np.lib.format.open_memmap(vectors_path, mode='w+', dtype=np.float32,
+                                           shape=(n_rows, self.dimension))
+        if len(keep_rows) == len(self.ids):
+            matrix[:len(self.ids)] = self.vectors
+        else:
+            for start in range(0, len(keep_rows), 65536):
+                rows = keep_rows[start:start + 65536]
+                matrix[start:start + len(rows)] = self.vectors[rows]
+        ids = [self.ids[row] for row in keep_rows] + new_ids
+        metadata = [self.metadata[row] for row in keep_rows] + [None] * len(new_ids)
+        id_to_row = {chunk_id: row for row, chunk_id in enumerate(ids)}
+        if self.pending:
+            self.spill.flush()
+            spilled = np.memmap(self.spill_path, dtype=np.float32, mode='r', shape=(self.spill_rows, self.dimension))
+            for chunk_id, (spill_row, meta) in self.pending.items():
+                row = id_to_row[chunk_id]
+                matrix[row] = spilled[spill_row]
+                metadata[row] = meta
+            del spilled
+        matrix.flush()
+        del matrix
+        with open(metadata_path, 'w', encoding='utf-8') as f:
+            for chunk_id, meta in zip(ids, metadata):
+                f.write(json.dumps({'id': chunk_id, 'metadata': meta}) + '\n')
+        with open(self.generation_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'generation': generation, 'rows': n_rows}, f)
+        os.replace(self.generation_path + '.tmp', self.generation_path)
+        self.vectors = None
+        self.pending = {}
+        self.pending_deletes = set()
+        self._close_spill()
+        self.load()
+        self.build_index()
+        self.build_codes()
+        self._remove_old_generations(keep=(self.generation, previous))
+
+    def _close_spill(self):
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+            os.remove(self.spill_path)
+        self.spill_rows = 0
+
+    def _remove_old_generations(self, keep):
+        # The previous generation stays for readers that read generation.json just before it was replaced;
+        # readers that still map an older file keep it alive after the unlink.
+        keep = {os.path.basename(_stamped_path(self.index_dir, name, generation))
+                for name in GENERATION_FILES for generation in keep}
+        stems = {os.path.splitext(name)[0] for name in GENERATION_FILES}
+        for name in os.listdir(self.index_dir):
+            stale = name not in keep and name.split('-')[0].split('.')[0] in stems
+            if stale or name.endswith('.tmp'):
+                os.remove(os.path.join(self.index_dir, name))
+
+    def query(self, embedding, k=5, nprobe=None):
+        if not self.ids:
+            return []
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        rows = None
+        if self.ann_index is not None:
+            rows = np.sort(self.ann_index.candidates(query, nprobe))
+        if self.quantizer is not None:
+            codes = self.codes if rows is None else self.codes[rows]
+            approx = self.quantizer.score(codes, query)
+            n_candidates = min(k * self.rerank_factor, len(approx))
+            if n_candidates == 0:
+                return []
+            top = np.argpartition(-approx, n_candidates - 1)[:n_candidates]
+            top, scores = rerank(self.vectors, top if rows is None else rows[top], query, k)
+        elif rows is not None:
+            if len(rows) == 0:
+                return []
+            top, scores = rerank(self.vectors, rows, query, k)
+        else:
+            top = exact_search(self.vectors, query, k)
+            scores = self.vectors[top] @ query
+        return [(self.metadata[row], float(score)) for row, score in zip(top, scores)]
+
+    async def aquery(self, embedding, k=5, nprobe=None):
+        # The scan releases the GIL inside NumPy, so a worker thread overlaps with other sessions.
+        return await asyncio.to_thread(self.query, embedding, k, nprobe)
+
+    def query_many(self, embeddings, k=5, nprobe=None):
+        """query() for many embeddings; an exact scan reads the matrix once for all of them."""
+        if not self.ids or not len(embeddings):
+            return [[] for _ in embeddings]
+        if self.ann_index is not None or self.quantizer is not None:
+            return [self.query(embedding, k, nprobe) for embedding in embeddings]
+        rows, scores = exact_search_many(self.vectors, _normalize(np.asarray(embeddings, dtype=np.float32)), k)
+        return [[(self.metadata[row], float(score)) for row, score in zip(top, top_scores)]
+                for top, top_scores in zip(rows, scores)]
+
+
+def _version_path():
+    return os.path.join(os.getenv('CACHE_DIR', '.cache'), 'index_version')
+
+
+def mark_index_updated():
+    # Written after every ingest so caches in other processes see the rebuild.
+    os.makedirs(os.path.dirname(_version_path()), exist_ok=True)
+    with open(_version_path(), 'w', encoding='utf-8') as f:
+        f.write(str(time.time()))
+
+
+def index_version():
+    try:
+        return os.stat(_version_path()).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load_vector_store(backend=None, index_name="ai-chatbot"):
+    # VECTOR_STORE=local keeps the index in-process; anything else uses Pinecone.
+    backend = (backend or os.getenv('VECTOR_STORE', 'pinecone')).lower()
+    if backend == 'local':
+        return LocalVectorStore(index_name=index_name)
+    if backend == 'pinecone':
+        return PineconeStore(index_name=index_name)
+    raise ValueError(f"Unknown vector store backend: {backend}")